@@ -3,24 +3,45 @@ Database models per Sanoid Manager
 Con supporto autenticazione integrata Proxmox
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Enum, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from datetime import datetime
 import os
 import enum
 
 DATABASE_PATH = os.environ.get("SANOID_MANAGER_DB", "/var/lib/sanoid-manager/sanoid-manager.db")
-os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+# ":memory:" (test): database in RAM, una sola connessione condivisa per engine
+IN_MEMORY = DATABASE_PATH == ":memory:"
+if not IN_MEMORY and os.path.dirname(DATABASE_PATH):
+    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    **({"poolclass": StaticPool} if IN_MEMORY else {})
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine async (aiosqlite) per i task asyncio (scheduler): le query non bloccano l'event loop.
+# Pool esplicito: ogni task apre la propria sessione (async with) e restituisce la connessione al pool.
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DATABASE_PATH}",
+    **({"poolclass": StaticPool} if IN_MEMORY else {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_pre_ping": True
+    })
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -251,6 +272,10 @@ class Dataset(Base):
 class SyncJob(Base):
     """Job di sincronizzazione Syncoid"""
     __tablename__ = "sync_jobs"
+    __table_args__ = (
+        # Query dello scheduler: job attivi con schedule
+        Index("ix_syncjob_active_sched", "is_active", "schedule"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(200), nullable=False)
@@ -271,6 +296,7 @@ class SyncJob(Base):
     
     # Scheduling (cron format)
     schedule = Column(String(100), nullable=True)  # es: "0 */4 * * *" ogni 4 ore
+    next_run = Column(DateTime, nullable=True, index=True)  # Prossima esecuzione (scritta dallo scheduler)
     is_active = Column(Boolean, default=True)
     
     # VM Registration
@@ -396,6 +422,18 @@ class APIKey(Base):
 
 # ============== HELPER FUNCTIONS ==============
 
+def ensure_indexes(bind=None):
+    """
+    Crea gli indici mancanti su tabelle già esistenti.
+    
+    create_all() crea gli indici solo insieme a tabelle nuove: per i database
+    creati da versioni precedenti vanno aggiunti qui.
+    """
+    bind = bind or engine
+    for index in SyncJob.__table__.indexes:
+        index.create(bind=bind, checkfirst=True)
+
+
 def init_default_config(db_session):
     """Inizializza configurazione di default se non esiste"""
     
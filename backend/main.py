@@ -9,12 +9,14 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 
-from database import engine, Base, get_db, init_default_config, SessionLocal
+from database import engine, Base, get_db, init_default_config, ensure_indexes, SessionLocal
 from routers import nodes, snapshots, sync_jobs, vms, logs, settings, auth, ssh_keys
-from services.scheduler import SchedulerService
+from services.scheduler import scheduler_service
+from services.ssh_service import ssh_pool
 
 # Configurazione logging
 logging.basicConfig(
@@ -23,16 +25,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Inizializzazione scheduler
-scheduler = SchedulerService()
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestione lifecycle dell'applicazione"""
     # Startup
     logger.info("Avvio Sanoid Manager...")
     Base.metadata.create_all(bind=engine)
+    ensure_indexes(engine)
     
     # Inizializza configurazione di default
     db = SessionLocal()
@@ -41,14 +40,17 @@ async def lifespan(app: FastAPI):
     finally:
         db.close()
     
-    await scheduler.start()
+    await scheduler_service.start()
+    ssh_pool_reaper = asyncio.create_task(ssh_pool.run_idle_reaper())
     logger.info("Sanoid Manager avviato")
     
     yield
     
     # Shutdown
     logger.info("Arresto Sanoid Manager...")
-    await scheduler.stop()
+    await scheduler_service.stop()
+    ssh_pool_reaper.cancel()
+    ssh_pool.close_all()
     logger.info("Sanoid Manager arrestato")
 
 
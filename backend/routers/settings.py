@@ -14,6 +14,7 @@ from database import (
     get_config_value, set_config_value, init_default_config
 )
 from routers.auth import get_current_user, require_admin, log_audit
+from services.scheduler import scheduler_service
 
 router = APIRouter()
 
@@ -159,6 +160,10 @@ async def update_setting(
     )
     
     db.commit()
+    
+    if key in scheduler_service.DAILY_SUMMARY_KEYS:
+        scheduler_service.invalidate_daily_summary_config()
+    
     return {"key": key, "value": update.value}
 
 
@@ -247,6 +252,10 @@ async def update_system_config(
     )
     
     db.commit()
+    
+    if key in scheduler_service.DAILY_SUMMARY_KEYS:
+        scheduler_service.invalidate_daily_summary_config()
+    
     return {"key": key, "value": update.value}
 
 
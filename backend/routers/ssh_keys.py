@@ -14,8 +14,8 @@ router = APIRouter(prefix="/ssh-keys", tags=["ssh-keys"])
 
 
 class GenerateKeyRequest(BaseModel):
-    key_type: str = "rsa"
-    bits: int = 4096
+    key_type: Optional[str] = None  # Default dal nome del file chiave (id_rsa -> rsa)
+    bits: int = 4096  # Ignorato per ed25519
     comment: str = "sanoid-manager"
     overwrite: bool = False
 
@@ -16,6 +16,8 @@ logger = logging.getLogger(__name__)
 SECRET_KEY = os.environ.get("SANOID_MANAGER_SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("SANOID_MANAGER_TOKEN_EXPIRE", 480))
+# Costo bcrypt degli hash nuovi (quelli esistenti restano verificabili con il loro costo)
+BCRYPT_ROUNDS = int(os.environ.get("SANOID_MANAGER_BCRYPT_ROUNDS", 12))
 
 
 class AuthService:
@@ -32,7 +34,7 @@ class AuthService:
         """Genera hash della password"""
         # Tronca a 72 byte (limite bcrypt)
         password_bytes = password.encode('utf-8')[:72]
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         hashed = bcrypt.hashpw(password_bytes, salt)
         return hashed.decode('utf-8')
     
@@ -34,13 +34,10 @@ class NotificationService:
             (now - self._last_config_load).seconds < self._config_cache_seconds):
             return self._config
         
-        db = SessionLocal()
-        try:
+        with SessionLocal() as db:
             self._config = db.query(NotificationConfig).first()
             self._last_config_load = now
             return self._config
-        finally:
-            db.close()
     
     def _configure_email_service(self, config: NotificationConfig):
         """Configura il servizio email con i dati dal database"""
@@ -7,6 +7,7 @@ from typing import Optional, Dict, List, Tuple
 import logging
 import json
 import re
+import time
 
 from services.ssh_service import ssh_service, SSHResult
 
@@ -16,6 +17,52 @@ logger = logging.getLogger(__name__)
 class ProxmoxService:
     """Servizio per integrazione con Proxmox VE"""
     
+    # Validità della mappa storage -> tipo in cache (storage aggiunti fuori dall'app)
+    STORAGE_TYPES_TTL = 300
+    
+    def __init__(self):
+        # Cache tipi storage per nodo: "user@host:port" -> (letto_alle, {storage: tipo})
+        self._storage_types: Dict[str, Tuple[float, Dict[str, str]]] = {}
+    
+    async def get_storage_types(
+        self,
+        hostname: str,
+        port: int = 22,
+        username: str = "root",
+        key_path: str = "/root/.ssh/id_rsa",
+        refresh: bool = False
+    ) -> Dict[str, str]:
+        """
+        Ottiene la mappa storage -> tipo (zfspool, dir, nfs, ...) del nodo.
+        Una sola chiamata `pvesm status` per nodo, poi servita dalla cache
+        per STORAGE_TYPES_TTL secondi.
+        """
+        cache_key = f"{username}@{hostname}:{port}"
+        cached = self._storage_types.get(cache_key)
+        if not refresh and cached and time.monotonic() - cached[0] < self.STORAGE_TYPES_TTL:
+            return cached[1]
+        
+        result = await ssh_service.execute(
+            hostname=hostname,
+            command="pvesm status 2>/dev/null | tail -n +2",
+            port=port,
+            username=username,
+            key_path=key_path
+        )
+        
+        if not result.success:
+            return {}
+        
+        # Format: Name Type Status Total Used Available %
+        storage_types = {}
+        for line in result.stdout.strip().split('\n'):
+            parts = line.split()
+            if len(parts) >= 2:
+                storage_types[parts[0]] = parts[1]
+        
+        self._storage_types[cache_key] = (time.monotonic(), storage_types)
+        return storage_types
+    
     async def get_vm_list(
         self,
         hostname: str,
@@ -33,21 +80,20 @@ class ProxmoxService:
             key_path=key_path
         )
         
-        vms = []
-        if result.success:
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    # Format: VMID NAME STATUS MEM BOOTDISK PID
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        vms.append({
-                            "vmid": int(parts[0]),
-                            "name": parts[1],
-                            "status": parts[2],
-                            "type": "qemu"
-                        })
-        
-        return vms
+        if not result.success:
+            return []
+        
+        # Format: VMID NAME STATUS MEM BOOTDISK PID
+        return [
+            {
+                "vmid": int(parts[0]),
+                "name": parts[1],
+                "status": parts[2],
+                "type": "qemu"
+            }
+            for line in result.stdout.splitlines()
+            if line and len(parts := line.split()) >= 3
+        ]
     
     async def get_container_list(
         self,
@@ -66,21 +112,20 @@ class ProxmoxService:
             key_path=key_path
         )
         
-        containers = []
-        if result.success:
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    # Format: VMID STATUS LOCK NAME
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        containers.append({
-                            "vmid": int(parts[0]),
-                            "status": parts[1],
-                            "name": parts[3] if len(parts) >= 4 else f"CT{parts[0]}",
-                            "type": "lxc"
-                        })
-        
-        return containers
+        if not result.success:
+            return []
+        
+        # Format: VMID STATUS LOCK NAME
+        return [
+            {
+                "vmid": int(parts[0]),
+                "status": parts[1],
+                "name": parts[3] if len(parts) >= 4 else f"CT{parts[0]}",
+                "type": "lxc"
+            }
+            for line in result.stdout.splitlines()
+            if line and len(parts := line.split()) >= 2
+        ]
     
     async def get_all_guests(
         self,
@@ -262,45 +307,42 @@ class ProxmoxService:
         disk_pattern = r'(?:scsi|sata|virtio|ide|mp)\d+:\s*(\S+):(\S+)'
         disks = re.findall(disk_pattern, config)
         
+        # Scarta subito gli storage non ZFS (NFS, dir, ...): nessuna chiamata SSH per loro
+        storage_types = await self.get_storage_types(hostname, port, username, key_path)
+        if any(s not in storage_types for s, _ in disks):
+            # Storage sconosciuto alla cache (es. creato da poco in Proxmox): rilettura
+            storage_types = await self.get_storage_types(hostname, port, username, key_path, refresh=True)
+        disks = [(s, d) for (s, d) in disks if storage_types.get(s) == "zfspool"]
+        
         datasets = []
         
         for storage, disk_name in disks:
-            # Trova il path ZFS dello storage
-            result = await ssh_service.execute(
+            # È uno storage ZFS, trova il dataset
+            path_result = await ssh_service.execute(
                 hostname=hostname,
-                command=f"pvesm status -storage {storage} 2>/dev/null | grep -E 'zfspool|dir'",
+                command=f"pvesm path {storage}:{disk_name} 2>/dev/null",
                 port=port,
                 username=username,
                 key_path=key_path
             )
             
-            if result.success and "zfspool" in result.stdout:
-                # È uno storage ZFS, trova il dataset
-                result2 = await ssh_service.execute(
-                    hostname=hostname,
-                    command=f"pvesm path {storage}:{disk_name} 2>/dev/null",
-                    port=port,
-                    username=username,
-                    key_path=key_path
-                )
-                
-                if result2.success:
-                    # Output format: /dev/zvol/rpool/data/vm-100-disk-0
-                    path = result2.stdout.strip()
-                    if path.startswith("/dev/zvol/"):
-                        dataset = path.replace("/dev/zvol/", "")
-                        datasets.append(dataset)
-                    elif path.startswith("/"):
-                        # Potrebbe essere un dataset montato
-                        result3 = await ssh_service.execute(
-                            hostname=hostname,
-                            command=f"zfs list -H -o name {path} 2>/dev/null",
-                            port=port,
-                            username=username,
-                            key_path=key_path
-                        )
-                        if result3.success:
-                            datasets.append(result3.stdout.strip())
+            if path_result.success:
+                # Output format: /dev/zvol/rpool/data/vm-100-disk-0
+                path = path_result.stdout.strip()
+                if path.startswith("/dev/zvol/"):
+                    dataset = path.replace("/dev/zvol/", "")
+                    datasets.append(dataset)
+                elif path.startswith("/"):
+                    # Potrebbe essere un dataset montato
+                    dataset_result = await ssh_service.execute(
+                        hostname=hostname,
+                        command=f"zfs list -H -o name {path} 2>/dev/null",
+                        port=port,
+                        username=username,
+                        key_path=key_path
+                    )
+                    if dataset_result.success:
+                        datasets.append(dataset_result.stdout.strip())
         
         # Aggiungi anche il parent dataset se esiste (es: rpool/data)
         if datasets:
@@ -360,6 +402,8 @@ class ProxmoxService:
         )
         
         if result.success or "already exists" in result.stderr:
+            # Lo storage appena creato deve comparire nella cache dei tipi
+            self._storage_types.pop(f"{username}@{hostname}:{port}", None)
             return True, f"Storage {storage_name} creato/verificato"
         else:
             return False, f"Errore creazione storage: {result.stderr}"
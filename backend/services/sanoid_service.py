@@ -61,9 +61,9 @@ if command -v sanoid &> /dev/null; then
     exit 0
 fi
 
-# Installa dipendenze
+# Installa dipendenze di build (quelle runtime arrivano insieme al .deb)
 apt-get update
-apt-get install -y debhelper libcapture-tiny-perl libconfig-inifiles-perl pv lzop mbuffer
+apt-get install -y --no-install-recommends debhelper
 
 # Clona e installa sanoid
 cd /tmp
@@ -78,7 +78,11 @@ git checkout $LATEST_TAG
 # Build e install
 ln -sf packages/debian .
 dpkg-buildpackage -uc -us
-apt-get install -y ../sanoid_*.deb
+
+# Unica installazione: pacchetto + dipendenze runtime (apt accetta path locali)
+cd ..
+apt-get install -y --no-install-recommends \\
+    libcapture-tiny-perl libconfig-inifiles-perl pv lzop mbuffer ./sanoid_*.deb
 
 # Crea directory config se non esiste
 mkdir -p /etc/sanoid
@@ -4,30 +4,70 @@ Con supporto notifiche e riepilogo giornaliero
 """
 
 import asyncio
-from datetime import datetime, time
-from typing import Dict, Optional, Callable
+import functools
+import heapq
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Callable, Set, Tuple
 import logging
 from croniter import croniter
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
-from database import SessionLocal, SyncJob, JobLog, Node, NotificationConfig, SystemConfig
+from database import AsyncSessionLocal, SyncJob, JobLog, Node, NotificationConfig, SystemConfig
 from services.syncoid_service import syncoid_service
 from services.proxmox_service import proxmox_service
 from services.notification_service import notification_service
 
 logger = logging.getLogger(__name__)
 
+# Numero massimo di sync schedulate eseguite contemporaneamente
+MAX_PARALLEL_SYNCS = int(os.environ.get("SANOID_MANAGER_MAX_PARALLEL_SYNCS", 4))
+
+
+@functools.lru_cache(maxsize=128)
+def _dataset_pattern(source_dataset: str) -> "re.Pattern":
+    """Regex compilata (una volta per dataset) che trova il dataset sorgente come nome intero"""
+    # Il lookbehind evita i dataset che lo contengono (es. myrpool/data per rpool/data),
+    # il lookahead quelli con lo stesso prefisso (es. vm-100-disk-0 / vm-100-disk-01)
+    return re.compile(r"(?<![\w./-])" + re.escape(source_dataset) + r"(?=[/,\s]|$)", re.MULTILINE)
+
 
 class SchedulerService:
     """Servizio per scheduling dei job di sincronizzazione"""
     
+    # Attesa massima tra due risvegli (protegge da salti dell'orologio di sistema)
+    MAX_SLEEP_SECONDS = 3600
+    # Validità della configurazione del riepilogo letta dal DB
+    CONFIG_TTL = timedelta(minutes=5)
+    # Chiavi SystemConfig che governano il riepilogo giornaliero
+    DAILY_SUMMARY_KEYS = ("daily_summary_hour", "daily_summary_enabled")
+    # Ora predefinita del riepilogo (UTC), usata anche se quella configurata non è valida
+    DEFAULT_DAILY_SUMMARY_HOUR = 8
+    
     def __init__(self):
         self._running = False
         self._task: Optional[asyncio.Task] = None
-        self._jobs: Dict[int, datetime] = {}  # job_id -> next_run
+        # job_id -> (croniter, next_run); next_run in secondi epoch UTC
+        self._jobs: Dict[int, Tuple[croniter, float]] = {}
+        # Coda di priorità (next_run, job_id); voci obsolete scartate in estrazione
+        self._heap: List[Tuple[float, int]] = []
+        # next_run modificati in memoria e non ancora salvati su DB (None = non schedulato)
+        self._pending_next_run: Dict[int, Optional[float]] = {}
+        self._next_wakeup: Optional[datetime] = None
+        # Interrompe l'attesa quando cambia uno schedule (creato in start(), dentro l'event loop)
+        self._wake_event: Optional[asyncio.Event] = None
         self._last_daily_summary: Optional[datetime] = None
-        self._daily_summary_hour: int = 8  # Ora predefinita: 08:00 UTC
+        self._daily_summary_hour: int = self.DEFAULT_DAILY_SUMMARY_HOUR
         self._daily_summary_enabled: bool = True
+        self._config_loaded_at: Optional[datetime] = None
+        # Limita le sync concorrenti quando molti cron coincidono (es. mezzanotte)
+        self._sync_slots = asyncio.Semaphore(max(1, MAX_PARALLEL_SYNCS))
+        # Task di esecuzione attivi: riferimenti forti e attesa allo shutdown
+        self._running_tasks: Set[asyncio.Task] = set()
     
     async def start(self):
         """Avvia lo scheduler"""
@@ -35,11 +75,13 @@ class SchedulerService:
             return
         
         self._running = True
+        self._wake_event = asyncio.Event()
+        await self._load_jobs()
         self._task = asyncio.create_task(self._scheduler_loop())
         logger.info("Scheduler avviato")
         
         # Carica configurazione orario riepilogo
-        self._load_daily_summary_config()
+        await self._load_daily_summary_config()
     
     async def stop(self):
         """Ferma lo scheduler"""
@@ -50,36 +92,95 @@ class SchedulerService:
                 await self._task
             except asyncio.CancelledError:
                 pass
+        
+        # Attende le sync in corso per non interrompere i commit a metà
+        if self._running_tasks:
+            logger.info(f"Attesa di {len(self._running_tasks)} esecuzioni in corso...")
+            await asyncio.gather(*self._running_tasks, return_exceptions=True)
         logger.info("Scheduler fermato")
     
-    def _load_daily_summary_config(self):
-        """Carica la configurazione dell'orario del riepilogo giornaliero"""
-        db = SessionLocal()
-        try:
-            # Orario
-            hour_config = db.query(SystemConfig).filter(
-                SystemConfig.key == "daily_summary_hour"
-            ).first()
-            if hour_config and hour_config.value:
+    async def _load_jobs(self):
+        """Carica una sola volta i job schedulati e popola la coda delle esecuzioni"""
+        async with AsyncSessionLocal() as db:
+            # Solo le colonne necessarie allo scheduling, senza istanziare oggetti ORM
+            rows = (await db.execute(
+                select(SyncJob.id, SyncJob.schedule, SyncJob.last_run).where(
+                    SyncJob.is_active == True,
+                    SyncJob.schedule.isnot(None),
+                    SyncJob.schedule != ""
+                )
+            )).all()
+        
+        now = time.time()
+        for job_id, schedule, last_run in rows:
+            try:
+                # last_run è un datetime UTC naive: croniter lo interpreta come UTC
+                cron = croniter(schedule, last_run or now)
+                self._schedule(job_id, cron, cron.get_next(float))
+            except Exception as e:
+                logger.error(f"Errore scheduling job {job_id}: {e}")
+        
+        # Job non schedulati (disattivi, senza cron o cron non valido): un next_run
+        # rimasto da prima non deve farli eseguire
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(SyncJob)
+                .where(SyncJob.next_run.isnot(None), SyncJob.id.notin_(list(self._jobs)))
+                .values(next_run=None)
+            )
+            await db.commit()
+        
+        logger.info(f"Scheduler: {len(self._jobs)} job schedulati")
+    
+    def _schedule(self, job_id: int, cron: croniter, next_run: float):
+        """Registra la prossima esecuzione di un job"""
+        self._jobs[job_id] = (cron, next_run)
+        heapq.heappush(self._heap, (next_run, job_id))
+        self._pending_next_run[job_id] = next_run
+        if self._wake_event:
+            self._wake_event.set()
+    
+    async def _load_daily_summary_config(self):
+        """Carica la configurazione dell'orario del riepilogo giornaliero (con cache TTL)"""
+        now = datetime.utcnow()
+        if self._config_loaded_at and (now - self._config_loaded_at) < self.CONFIG_TTL:
+            return
+        
+        async with AsyncSessionLocal() as db:
+            # Entrambe le chiavi in un'unica query
+            rows = await db.execute(
+                select(SystemConfig.key, SystemConfig.value)
+                .where(SystemConfig.key.in_(self.DAILY_SUMMARY_KEYS))
+            )
+            values = dict(rows.all())
+            
+            # Orario: fuori da 0-23 farebbe fallire datetime.replace nel loop dello scheduler
+            hour_value = values.get("daily_summary_hour")
+            self._daily_summary_hour = self.DEFAULT_DAILY_SUMMARY_HOUR
+            if hour_value:
                 try:
-                    self._daily_summary_hour = int(hour_config.value)
+                    hour = int(hour_value)
                 except ValueError:
-                    pass
+                    hour = -1
+                if 0 <= hour <= 23:
+                    self._daily_summary_hour = hour
+                else:
+                    logger.warning(
+                        f"Ora riepilogo non valida: {hour_value!r}, uso {self.DEFAULT_DAILY_SUMMARY_HOUR}"
+                    )
             
             # Abilitato/Disabilitato
-            enabled_config = db.query(SystemConfig).filter(
-                SystemConfig.key == "daily_summary_enabled"
-            ).first()
+            enabled_value = values.get("daily_summary_enabled")
             self._daily_summary_enabled = True
-            if enabled_config and enabled_config.value:
-                self._daily_summary_enabled = enabled_config.value.lower() in ("true", "1", "yes")
+            if enabled_value:
+                self._daily_summary_enabled = enabled_value.lower() in ("true", "1", "yes")
+            
+            self._config_loaded_at = now
             
             if self._daily_summary_enabled:
                 logger.info(f"Riepilogo giornaliero schedulato alle ore {self._daily_summary_hour}:00 UTC")
             else:
                 logger.info("Riepilogo giornaliero disabilitato")
-        finally:
-            db.close()
     
     async def _scheduler_loop(self):
         """Loop principale dello scheduler"""
@@ -87,13 +188,64 @@ class SchedulerService:
             try:
                 await self._check_and_run_jobs()
                 await self._check_daily_summary()
-                await asyncio.sleep(60)  # Check ogni minuto
+                await self._wait_next_wakeup()
             except Exception as e:
                 logger.error(f"Errore nello scheduler: {e}")
                 await asyncio.sleep(60)
     
+    def _next_daily_summary(self, now: datetime) -> Optional[datetime]:
+        """Prossimo istante in cui va controllato il riepilogo giornaliero"""
+        if not self._daily_summary_enabled:
+            return None
+        
+        start = now.replace(hour=self._daily_summary_hour, minute=0, second=0, microsecond=0)
+        sent_today = self._last_daily_summary and self._last_daily_summary.date() == now.date()
+        if sent_today or now >= start + timedelta(hours=1):
+            return start + timedelta(days=1)
+        
+        # Nell'ora giusta ma non ancora inviato (es. errore): nuovo tentativo tra un minuto
+        return max(start, now + timedelta(minutes=1))
+    
+    async def _wait_next_wakeup(self):
+        """Dorme fino al prossimo job o riepilogo, o finché uno schedule non cambia"""
+        # Azzera prima di calcolare: un cambio arrivato nel frattempo non va perso
+        self._wake_event.clear()
+        
+        # Scarta in testa le voci obsolete per non svegliarsi a vuoto
+        while self._heap and self._jobs.get(self._heap[0][1], (None, None))[1] != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        
+        now = time.time()
+        candidates = []
+        next_summary = self._next_daily_summary(datetime.utcfromtimestamp(now))
+        if next_summary:
+            candidates.append(next_summary.replace(tzinfo=timezone.utc).timestamp())
+        if self._heap:
+            candidates.append(self._heap[0][0])
+        
+        timeout = self.MAX_SLEEP_SECONDS
+        self._next_wakeup = None
+        if candidates:
+            wakeup = min(candidates)
+            timeout = min(timeout, max(0, wakeup - now))
+            self._next_wakeup = datetime.utcfromtimestamp(wakeup)
+        
+        try:
+            await asyncio.wait_for(self._wake_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    def invalidate_daily_summary_config(self):
+        """Forza la rilettura della configurazione del riepilogo (es. dopo modifica da admin)"""
+        self._config_loaded_at = None
+        if self._wake_event:
+            self._wake_event.set()
+    
     async def _check_daily_summary(self):
         """Verifica se è ora di inviare il riepilogo giornaliero"""
+        # Configurazione dalla cache: il DB viene riletto solo se scaduta o invalidata
+        await self._load_daily_summary_config()
+        
         # Verifica se abilitato
         if not self._daily_summary_enabled:
             return
@@ -108,11 +260,6 @@ class SchedulerService:
                 if self._last_daily_summary.date() == now.date():
                     return  # Già inviato oggi
             
-            # Ricarica configurazione (potrebbe essere cambiata)
-            self._load_daily_summary_config()
-            if not self._daily_summary_enabled:
-                return
-            
             # Invia riepilogo
             logger.info("Invio riepilogo giornaliero...")
             try:
@@ -126,158 +273,227 @@ class SchedulerService:
                 logger.error(f"Errore invio riepilogo giornaliero: {e}")
     
     async def _check_and_run_jobs(self):
-        """Verifica e esegue i job schedulati"""
-        db = SessionLocal()
-        try:
-            # Ottieni job attivi con schedule
-            jobs = db.query(SyncJob).filter(
-                SyncJob.is_active == True,
-                SyncJob.schedule.isnot(None),
-                SyncJob.schedule != ""
-            ).all()
-            
-            now = datetime.utcnow()
+        """Esegue i job la cui esecuzione è scaduta (next_run <= adesso su DB)"""
+        now = time.time()
+        popped_ids = []
+        
+        # Cambi di schedule arrivati dall'ultimo controllo: vanno salvati prima di leggere i job scaduti
+        pending, self._pending_next_run = self._pending_next_run, {}
+        
+        # Avanza in memoria le schedule in testa alla coda (i nuovi valori finiscono in _pending_next_run)
+        while self._heap and self._heap[0][0] <= now:
+            next_run, job_id = heapq.heappop(self._heap)
+            entry = self._jobs.get(job_id)
+            if entry is None or entry[1] != next_run:
+                continue  # Job rimosso o rischedulato
             
-            for job in jobs:
-                try:
-                    # Calcola prossima esecuzione
-                    if job.id not in self._jobs:
-                        # Prima volta, calcola dalla schedule
-                        cron = croniter(job.schedule, job.last_run or now)
-                        self._jobs[job.id] = cron.get_next(datetime)
-                    
-                    next_run = self._jobs[job.id]
-                    
-                    if now >= next_run:
-                        # Tempo di eseguire
-                        logger.info(f"Esecuzione job schedulato: {job.name} (ID: {job.id})")
-                        asyncio.create_task(self._execute_job(job.id))
-                        
-                        # Calcola prossima esecuzione
-                        cron = croniter(job.schedule, now)
-                        self._jobs[job.id] = cron.get_next(datetime)
-                        
-                except Exception as e:
-                    logger.error(f"Errore scheduling job {job.id}: {e}")
-        finally:
-            db.close()
+            cron = entry[0]
+            try:
+                # Eseguito una volta sola anche se ha perso più esecuzioni: l'iteratore riparte
+                # da adesso invece di scorrerle tutte (es. "* * * * *" dopo settimane di fermo)
+                cron.set_current(now)
+                next_run = cron.get_next(float)
+                self._schedule(job_id, cron, next_run)
+                popped_ids.append(job_id)
+            except Exception as e:
+                logger.error(f"Errore scheduling job {job_id}: {e}")
+        
+        if not pending and not popped_ids:
+            return
+        
+        due_ids = []
+        try:
+            async with AsyncSessionLocal() as db:
+                await self._save_next_runs(db, pending)
+                
+                if popped_ids:
+                    # Il DB conferma quali dei job estratti dalla coda sono ancora da eseguire
+                    due_ids = (await db.execute(
+                        select(SyncJob.id).where(
+                            SyncJob.id.in_(popped_ids),
+                            SyncJob.is_active == True,
+                            SyncJob.schedule.isnot(None),
+                            SyncJob.schedule != "",
+                            SyncJob.next_run <= datetime.utcfromtimestamp(now)
+                        )
+                    )).scalars().all()
+                
+                # Prossime esecuzioni dei job appena avanzati; copia: durante gli await i router
+                # possono aggiungere altri cambi (update_job_schedule/remove_job)
+                saved = dict(self._pending_next_run)
+                await self._save_next_runs(db, saved)
+                await db.commit()
+            # Tolti solo i valori salvati: quelli arrivati o cambiati nel frattempo restano
+            for job_id, value in saved.items():
+                if job_id in self._pending_next_run and self._pending_next_run[job_id] == value:
+                    del self._pending_next_run[job_id]
+        except Exception:
+            # Scrittura non riuscita: i valori restano da salvare al prossimo controllo
+            self._pending_next_run = {**pending, **self._pending_next_run}
+            raise
+        
+        if due_ids:
+            # Un solo task per il gruppo: il loop dello scheduler non attende la fine delle sync
+            task = asyncio.create_task(self._run_due_jobs(due_ids))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+    
+    async def _save_next_runs(self, db: AsyncSession, next_runs: Dict[int, Optional[float]]):
+        """Scrive su DB i next_run calcolati dallo scheduler (una sola executemany)"""
+        if not next_runs:
+            return
+        
+        table = SyncJob.__table__
+        await db.execute(
+            update(table).where(table.c.id == bindparam("job_id")).values(next_run=bindparam("value")),
+            [
+                {"job_id": job_id, "value": datetime.utcfromtimestamp(ts) if ts is not None else None}
+                for job_id, ts in next_runs.items()
+            ]
+        )
+    
+    async def _run_due_jobs(self, job_ids: List[int]):
+        """Esegue in parallelo (entro MAX_PARALLEL_SYNCS) i job scaduti nello stesso controllo"""
+        results = await asyncio.gather(
+            *(self._execute_job_limited(job_id) for job_id in job_ids),
+            return_exceptions=True
+        )
+        for job_id, result in zip(job_ids, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Errore esecuzione job {job_id}: {result}")
+    
+    async def _execute_job_limited(self, job_id: int):
+        """Esegue un job occupando uno slot di esecuzione"""
+        async with self._sync_slots:
+            await self._execute_job(job_id)
     
     async def _execute_job(self, job_id: int):
         """Esegue un job di sincronizzazione"""
-        db = SessionLocal()
-        log_entry = None
-        
-        try:
-            job = db.query(SyncJob).filter(SyncJob.id == job_id).first()
-            if not job:
-                logger.error(f"Job {job_id} non trovato")
-                return
+        async with AsyncSessionLocal() as db:
+            log_entry = None
             
-            source_node = db.query(Node).filter(Node.id == job.source_node_id).first()
-            dest_node = db.query(Node).filter(Node.id == job.dest_node_id).first()
+            try:
+                # Job completo (con i nodi) caricato solo qui, dove viene modificato
+                job = (await db.execute(
+                    select(SyncJob)
+                    .options(joinedload(SyncJob.source_node), joinedload(SyncJob.dest_node))
+                    .where(SyncJob.id == job_id, SyncJob.is_active == True)
+                )).scalars().first()
+                if not job:
+                    return
+                
+                logger.info(f"Esecuzione job schedulato: {job.name} (ID: {job_id})")
+                source_node = job.source_node
+                dest_node = job.dest_node
             
-            if not source_node or not dest_node:
-                logger.error(f"Nodi non trovati per job {job_id}")
-                return
+                if not source_node or not dest_node:
+                    logger.error(f"Nodi non trovati per job {job_id}")
+                    return
             
-            # Crea log entry
-            log_entry = JobLog(
-                job_type="sync",
-                job_id=job_id,
-                node_name=f"{source_node.name} -> {dest_node.name}",
-                dataset=f"{job.source_dataset} -> {job.dest_dataset}",
-                status="started",
-                message=f"Sincronizzazione avviata"
-            )
-            db.add(log_entry)
-            db.commit()
+                # Crea log entry
+                log_entry = JobLog(
+                    job_type="sync",
+                    job_id=job_id,
+                    node_name=f"{source_node.name} -> {dest_node.name}",
+                    dataset=f"{job.source_dataset} -> {job.dest_dataset}",
+                    status="started",
+                    message=f"Sincronizzazione avviata"
+                )
+                db.add(log_entry)
             
-            # Aggiorna stato job
-            job.last_status = "running"
-            db.commit()
+                # Aggiorna stato job nella stessa transazione del log
+                job.last_status = "running"
+                await db.commit()
             
-            # Determina da dove eseguire (sorgente)
-            executor_host = source_node.hostname
+                # Determina da dove eseguire (sorgente)
+                executor_host = source_node.hostname
             
-            # Esegui sync
-            result = await syncoid_service.run_sync(
-                executor_host=executor_host,
-                source_host=None,  # Locale all'executor
-                source_dataset=job.source_dataset,
-                dest_host=dest_node.hostname,
-                dest_dataset=job.dest_dataset,
-                dest_user=dest_node.ssh_user,
-                dest_port=dest_node.ssh_port,
-                dest_key=dest_node.ssh_key_path,
-                executor_port=source_node.ssh_port,
-                executor_user=source_node.ssh_user,
-                executor_key=source_node.ssh_key_path,
-                recursive=job.recursive,
-                compress=job.compress or "lz4",
-                mbuffer_size=job.mbuffer_size or "128M",
-                no_sync_snap=job.no_sync_snap,
-                force_delete=job.force_delete,
-                extra_args=job.extra_args or ""
-            )
+                # Esegui sync
+                result = await syncoid_service.run_sync(
+                    executor_host=executor_host,
+                    source_host=None,  # Locale all'executor
+                    source_dataset=job.source_dataset,
+                    dest_host=dest_node.hostname,
+                    dest_dataset=job.dest_dataset,
+                    dest_user=dest_node.ssh_user,
+                    dest_port=dest_node.ssh_port,
+                    dest_key=dest_node.ssh_key_path,
+                    executor_port=source_node.ssh_port,
+                    executor_user=source_node.ssh_user,
+                    executor_key=source_node.ssh_key_path,
+                    recursive=job.recursive,
+                    compress=job.compress or "lz4",
+                    mbuffer_size=job.mbuffer_size or "128M",
+                    no_sync_snap=job.no_sync_snap,
+                    force_delete=job.force_delete,
+                    extra_args=job.extra_args or ""
+                )
+            
+                # Aggiorna job
+                job.last_run = datetime.utcnow()
+                job.last_duration = result["duration"]
+                job.last_transferred = result.get("transferred")
+                job.run_count += 1
             
-            # Aggiorna job
-            job.last_run = datetime.utcnow()
-            job.last_duration = result["duration"]
-            job.last_transferred = result.get("transferred")
-            job.run_count += 1
+                # Post-sync indipendenti (registrazione VM e notifica): eseguiti in parallelo
+                post_sync = []
             
-            if result["success"]:
-                job.last_status = "success"
-                log_entry.status = "success"
-                log_entry.message = "Sincronizzazione completata"
+                if result["success"]:
+                    job.last_status = "success"
+                    log_entry.status = "success"
+                    log_entry.message = "Sincronizzazione completata"
                 
-                # Registra VM se richiesto
-                if job.register_vm and job.vm_id:
-                    await self._register_vm_after_sync(db, job, source_node, dest_node, log_entry)
-            else:
-                job.last_status = "failed"
-                job.error_count += 1
-                log_entry.status = "failed"
-                log_entry.message = "Sincronizzazione fallita"
-                log_entry.error = result.get("error", "")
+                    # Registra VM se richiesto
+                    if job.register_vm and job.vm_id:
+                        post_sync.append(
+                            self._register_vm_after_sync(db, job, source_node, dest_node, log_entry)
+                        )
+                else:
+                    job.last_status = "failed"
+                    job.error_count += 1
+                    log_entry.status = "failed"
+                    log_entry.message = "Sincronizzazione fallita"
+                    log_entry.error = result.get("error", "")
             
-            log_entry.output = result.get("output", "")
-            log_entry.duration = result["duration"]
-            log_entry.transferred = result.get("transferred")
-            log_entry.completed_at = datetime.utcnow()
+                log_entry.output = result.get("output", "")
+                log_entry.duration = result["duration"]
+                log_entry.transferred = result.get("transferred")
+                log_entry.completed_at = datetime.utcnow()
             
-            db.commit()
+                post_sync.append(self._notify_job_result(job, source_node, dest_node, result))
+                await asyncio.gather(*post_sync, return_exceptions=True)
             
-            # Invia notifica job completato
-            # Per job schedulati: max 1 notifica successo al giorno, fallimenti sempre notificati
-            try:
-                await notification_service.send_job_notification(
-                    job_name=job.name,
-                    status="success" if result["success"] else "failed",
-                    source=f"{source_node.name}:{job.source_dataset}",
-                    destination=f"{dest_node.name}:{job.dest_dataset}",
-                    duration=result["duration"],
-                    error=result.get("error") if not result["success"] else None,
-                    details=f"Trasferito: {result.get('transferred', 'N/A')}" if result["success"] else None,
-                    job_id=job_id,
-                    is_scheduled=True  # Job eseguito dallo scheduler = ricorrente
-                )
-            except Exception as notify_err:
-                logger.warning(f"Errore invio notifica per job {job_id}: {notify_err}")
+                await db.commit()
             
-        except Exception as e:
-            logger.error(f"Errore esecuzione job {job_id}: {e}")
-            if log_entry:
-                log_entry.status = "failed"
-                log_entry.error = str(e)
-                log_entry.completed_at = datetime.utcnow()
-                db.commit()
-        finally:
-            db.close()
+            except Exception as e:
+                logger.error(f"Errore esecuzione job {job_id}: {e}")
+                if log_entry:
+                    log_entry.status = "failed"
+                    log_entry.error = str(e)
+                    log_entry.completed_at = datetime.utcnow()
+                    await db.commit()
+    
+    async def _notify_job_result(self, job: SyncJob, source_node: Node, dest_node: Node, result: Dict):
+        """Invia la notifica di job completato"""
+        # Per job schedulati: max 1 notifica successo al giorno, fallimenti sempre notificati
+        try:
+            await notification_service.send_job_notification(
+                job_name=job.name,
+                status="success" if result["success"] else "failed",
+                source=f"{source_node.name}:{job.source_dataset}",
+                destination=f"{dest_node.name}:{job.dest_dataset}",
+                duration=result["duration"],
+                error=result.get("error") if not result["success"] else None,
+                details=f"Trasferito: {result.get('transferred', 'N/A')}" if result["success"] else None,
+                job_id=job.id,
+                is_scheduled=True  # Job eseguito dallo scheduler = ricorrente
+            )
+        except Exception as notify_err:
+            logger.warning(f"Errore invio notifica per job {job.id}: {notify_err}")
     
     async def _register_vm_after_sync(
         self,
-        db: Session,
+        db: AsyncSession,
         job: SyncJob,
         source_node: Node,
         dest_node: Node,
@@ -326,27 +542,32 @@ class SchedulerService:
         """
         Adatta la configurazione VM per il nodo destinazione
         
-        Sostituisce i riferimenti allo storage sorgente con quello destinazione
+        Sostituisce i riferimenti al dataset sorgente con quello destinazione
         """
-        # Estrai il nome dello storage dal dataset
-        # es: rpool/data -> local-zfs (dipende dalla config Proxmox)
-        # Per ora ritorniamo la config così com'è
-        # In produzione servirebbe una mappatura storage sorgente -> destinazione
+        # La mappatura degli storage Proxmox (source_storage -> dest_storage) è gestita
+        # da proxmox_service.register_vm; qui restano solo i path dei dataset
+        if not source_dataset or source_dataset == dest_dataset:
+            return config
         
-        return config
+        # Sostituzione tramite funzione: dest_dataset non viene interpretato come template
+        return _dataset_pattern(source_dataset).sub(lambda _: dest_dataset, config)
     
     def update_job_schedule(self, job_id: int, schedule: str):
         """Aggiorna lo schedule di un job"""
         if schedule:
-            cron = croniter(schedule, datetime.utcnow())
-            self._jobs[job_id] = cron.get_next(datetime)
-        elif job_id in self._jobs:
-            del self._jobs[job_id]
+            cron = croniter(schedule, time.time())
+            self._schedule(job_id, cron, cron.get_next(float))
+        else:
+            self.remove_job(job_id)
     
     def remove_job(self, job_id: int):
         """Rimuove un job dallo scheduler"""
-        if job_id in self._jobs:
-            del self._jobs[job_id]
+        # next_run azzerato anche se il job non era in memoria (es. cron non valido)
+        self._pending_next_run[job_id] = None
+        if self._jobs.pop(job_id, None) is not None:
+            # La voce nella coda resta e viene scartata in estrazione
+            if self._wake_event:
+                self._wake_event.set()
 
 
 # Singleton
@@ -3,15 +3,37 @@ SSH Key Service - Gestione chiavi SSH per sincronizzazione tra nodi
 """
 
 import os
+import re
 import asyncio
-import subprocess
+import base64
+import binascii
+import hashlib
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from typing import Optional, Tuple, List, Dict
 from dataclasses import dataclass
 import logging
 import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from services.ssh_service import (
+    ssh_pool, new_ssh_client, CONNECT_TIMEOUTS, KEEPALIVE_SECONDS, KNOWN_HOSTS_PATH
+)
 
 logger = logging.getLogger(__name__)
 
+# Massimo di connessioni SSH aperte insieme verso i nodi (sshd limita gli handshake non autenticati con MaxStartups)
+MAX_PARALLEL_SSH = 16
+
+# Riga di chiave pubblica: tipo, chiave base64, commento opzionale (anche con spazi)
+_PUBKEY_RE = re.compile(rb"^(\S+)(?:\s+(\S+))?(?:\s+(.*))?$")
+
+# Nomi file standard di OpenSSH -> tipo di chiave che contengono
+_KEY_TYPE_BY_FILENAME = {"id_rsa": "rsa", "id_ecdsa": "ecdsa", "id_ed25519": "ed25519"}
+
 
 @dataclass
 class SSHKeyInfo:
@@ -32,51 +54,129 @@ class KeyDistributionResult:
     already_present: bool = False
 
 
+
+def _remove_key_command(key: str) -> str:
+    """
+    Comando shell che toglie da authorized_keys le righe uguali alla chiave.
+    
+    Confronto letterale sulla riga intera (spazi finali esclusi): la chiave passa
+    dall'ambiente, quotata per la shell. Il file filtrato viene scritto in un
+    temporaneo (già 0600, creato da mktemp) accanto al file reale e sostituito con
+    un rename atomico; il percorso è risolto prima con readlink -f, così il symlink
+    di Proxmox verso /etc/pve/priv/authorized_keys resta al suo posto.
+    """
+    return (
+        'f=$(readlink -f ~/.ssh/authorized_keys) && [ -f "$f" ] || exit 1; '
+        't=$(mktemp "$f.XXXXXX") || exit 1; '
+        f"if K={shlex.quote(key.strip())} awk "
+        "'{ l = $0; sub(/[ \\t\\r]+$/, \"\", l) } l != ENVIRON[\"K\"]' \"$f\" > \"$t\" "
+        '&& mv -f "$t" "$f"; then exit 0; fi; rm -f "$t"; exit 1'
+    )
+
 class SSHKeyService:
     """Servizio per gestione chiavi SSH"""
     
     DEFAULT_KEY_PATH = "/root/.ssh/id_rsa"
     DEFAULT_AUTHORIZED_KEYS = "/root/.ssh/authorized_keys"
     
-    def __init__(self):
-        pass
+    def __init__(self, known_hosts_path: Optional[str] = None, strict: bool = False):
+        # Politica host key per le connessioni fuori dal pool (vedi new_ssh_client)
+        self.known_hosts_path = known_hosts_path
+        self.strict = strict
+        # Executor dedicato: le chiamate paramiko bloccanti non occupano quello di default del loop
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ssh-key")
+        # Cache dei file locali letti, invalidata dal cambio di mtime: path -> (st_mtime_ns, risultato)
+        self._key_info_cache: Dict[str, Tuple[int, SSHKeyInfo]] = {}
+        # percorso -> (mtime_ns, chiavi per la UI)
+        self._authorized_keys_cache: Dict[str, Tuple[int, List[Dict]]] = {}
+        # Coppie di chiavi lette: key_path -> (mtime privata, mtime pubblica, privata, pubblica)
+        self._key_cache: Dict[str, Tuple[int, int, str, str]] = {}
+        # Lock per host sulle modifiche di authorized_keys (lettura-modifica-scrittura)
+        self._host_locks: Dict[str, threading.Lock] = {}
+        self._host_locks_guard = threading.Lock()
+    
+    def _host_lock(self, hostname: str) -> threading.Lock:
+        """Lock dedicato alle modifiche di authorized_keys su un host"""
+        with self._host_locks_guard:
+            return self._host_locks.setdefault(hostname, threading.Lock())
+    
+    def _stat_pair(self, key_path: str) -> Tuple[Optional[os.stat_result], Optional[os.stat_result]]:
+        """Stat di chiave privata e pubblica; None al posto del file che manca"""
+        stats = []
+        for path in (key_path, f"{key_path}.pub"):
+            try:
+                stats.append(os.stat(path))
+            except FileNotFoundError:
+                stats.append(None)
+        return stats[0], stats[1]
+    
+    def _load_keys(
+        self,
+        key_path: str,
+        stats: Optional[Tuple[os.stat_result, os.stat_result]] = None
+    ) -> Tuple[str, str]:
+        """Legge la coppia di chiavi locale (privata, pubblica), riletta solo se i file cambiano"""
+        pub_key_path = f"{key_path}.pub"
+        if stats is None:
+            stats = (os.stat(key_path), os.stat(pub_key_path))
+        mtimes = (stats[0].st_mtime_ns, stats[1].st_mtime_ns)
+        
+        cached = self._key_cache.get(key_path)
+        if cached and cached[:2] == mtimes:
+            return cached[2], cached[3]
+        
+        with open(key_path, 'r') as f:
+            private_key = f.read()
+        with open(pub_key_path, 'r') as f:
+            public_key = f.read().strip()
+        
+        self._key_cache[key_path] = (*mtimes, private_key, public_key)
+        return private_key, public_key
     
     def get_key_info(self, key_path: str = None) -> SSHKeyInfo:
         """Ottiene informazioni sulla chiave SSH locale"""
         key_path = key_path or self.DEFAULT_KEY_PATH
         pub_key_path = f"{key_path}.pub"
         
-        if not os.path.exists(key_path) or not os.path.exists(pub_key_path):
+        st_priv, st_pub = self._stat_pair(key_path)
+        if st_priv is None or st_pub is None:
             return SSHKeyInfo(exists=False)
         
         try:
+            mtime = st_pub.st_mtime_ns
+            cached = self._key_info_cache.get(pub_key_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            
             # Leggi chiave pubblica
-            with open(pub_key_path, 'r') as f:
-                public_key = f.read().strip()
+            with open(pub_key_path, 'rb') as f:
+                raw = f.read().strip()
+            public_key = raw.decode()
             
             # Parsa la chiave pubblica
-            parts = public_key.split()
-            key_type = parts[0] if len(parts) > 0 else "unknown"
-            comment = parts[2] if len(parts) > 2 else ""
+            m = _PUBKEY_RE.match(raw)
+            key_type = m[1].decode() if m else "unknown"
+            comment = (m[3] or b"").decode() if m else ""
             
-            # Ottieni fingerprint
-            result = subprocess.run(
-                ['ssh-keygen', '-lf', pub_key_path],
-                capture_output=True,
-                text=True
-            )
+            # Fingerprint SHA256 come `ssh-keygen -lf`, calcolato senza processi esterni
             fingerprint = ""
-            if result.returncode == 0:
-                fp_parts = result.stdout.strip().split()
-                fingerprint = fp_parts[1] if len(fp_parts) > 1 else ""
+            if m and m[2]:
+                try:
+                    blob = base64.b64decode(m[2], validate=True)
+                    digest = base64.b64encode(hashlib.sha256(blob).digest()).rstrip(b"=").decode()
+                    fingerprint = f"SHA256:{digest}"
+                except (binascii.Error, ValueError):
+                    pass
             
-            return SSHKeyInfo(
+            info = SSHKeyInfo(
                 exists=True,
                 public_key=public_key,
                 key_type=key_type,
                 fingerprint=fingerprint,
                 comment=comment
             )
+            self._key_info_cache[pub_key_path] = (mtime, info)
+            return info
         except Exception as e:
             logger.error(f"Errore lettura chiave SSH: {e}")
             return SSHKeyInfo(exists=False)
@@ -84,67 +184,229 @@ class SSHKeyService:
     def generate_key(
         self, 
         key_path: str = None,
-        key_type: str = "rsa",
+        key_type: Optional[str] = None,
         bits: int = 4096,
         comment: str = "sanoid-manager",
         overwrite: bool = False
     ) -> Tuple[bool, str]:
-        """Genera una nuova coppia di chiavi SSH"""
+        """
+        Genera una nuova coppia di chiavi SSH.
+        
+        Senza key_type il tipo segue il nome del file (id_rsa -> RSA, id_ed25519 -> ed25519,
+        ed25519 per i nomi non standard); un tipo diverso da quello del nome standard è rifiutato.
+        """
         key_path = key_path or self.DEFAULT_KEY_PATH
+        file_type = _KEY_TYPE_BY_FILENAME.get(os.path.basename(key_path))
+        key_type = key_type or file_type or "ed25519"
+        if file_type and key_type != file_type:
+            return False, f"Il file {os.path.basename(key_path)} è riservato a chiavi {file_type}, non {key_type}"
         
         # Verifica se esiste già
-        if os.path.exists(key_path) and not overwrite:
+        if self._stat_pair(key_path)[0] is not None and not overwrite:
             return False, "La chiave esiste già. Usa overwrite=True per sovrascriverla."
         
         try:
             # Crea directory .ssh se non esiste
-            ssh_dir = os.path.dirname(key_path)
-            if not os.path.exists(ssh_dir):
-                os.makedirs(ssh_dir, mode=0o700)
+            os.makedirs(os.path.dirname(key_path), mode=0o700, exist_ok=True)
             
             # Rimuovi chiave esistente se overwrite
             if overwrite:
                 for f in [key_path, f"{key_path}.pub"]:
-                    if os.path.exists(f):
+                    try:
                         os.remove(f)
+                    except FileNotFoundError:
+                        pass
             
-            # Genera nuova chiave
-            cmd = [
-                'ssh-keygen',
-                '-t', key_type,
-                '-b', str(bits),
-                '-C', comment,
-                '-f', key_path,
-                '-N', ''  # Nessuna passphrase
-            ]
+            # Genera nuova chiave in-process (nessun fork di ssh-keygen)
+            if key_type == "ed25519":
+                private = ed25519.Ed25519PrivateKey.generate()
+            elif key_type == "rsa":
+                private = rsa.generate_private_key(public_exponent=65537, key_size=bits)
+            elif key_type == "ecdsa":
+                curves = {256: ec.SECP256R1, 384: ec.SECP384R1, 521: ec.SECP521R1}
+                private = ec.generate_private_key(curves.get(bits, ec.SECP256R1)())
+            else:
+                return False, f"Tipo chiave non supportato: {key_type}"
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            private_pem = private.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.OpenSSH,
+                serialization.NoEncryption()  # Nessuna passphrase
+            )
+            public_line = private.public_key().public_bytes(
+                serialization.Encoding.OpenSSH,
+                serialization.PublicFormat.OpenSSH
+            ).decode()
             
-            if result.returncode == 0:
-                # Imposta permessi corretti
-                os.chmod(key_path, 0o600)
-                os.chmod(f"{key_path}.pub", 0o644)
-                return True, "Chiave generata con successo"
-            else:
-                return False, f"Errore generazione chiave: {result.stderr}"
+            # Stessi file e permessi di ssh-keygen (privata creata già con 0600)
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(private_pem)
+            with open(f"{key_path}.pub", 'w') as f:
+                f.write(f"{public_line} {comment}\n")
+            os.chmod(key_path, 0o600)
+            os.chmod(f"{key_path}.pub", 0o644)
+            
+            # La chiave pubblica è cambiata: non usare le info in cache
+            self._key_info_cache.pop(f"{key_path}.pub", None)
+            
+            return True, "Chiave generata con successo"
                 
         except Exception as e:
             logger.error(f"Errore generazione chiave SSH: {e}")
             return False, str(e)
     
+    def _authorize_key(
+        self,
+        client: paramiko.SSHClient,
+        hostname: str,
+        public_key: str,
+        auth_method: str
+    ) -> KeyDistributionResult:
+        """Aggiunge la chiave pubblica agli authorized_keys dell'host (bloccante, client già connesso)"""
+        try:
+            sftp = client.open_sftp()
+        except paramiko.SSHException:
+            # Sottosistema SFTP non disponibile: aggiornamento via shell
+            return self._authorize_key_shell(client, hostname, public_key, auth_method)
+        
+        try:
+            # Lettura, deduplica e riscrittura dello stesso file serializzate per host
+            with self._host_lock(hostname):
+                try:
+                    sftp.mkdir(".ssh", 0o700)
+                except IOError:
+                    pass  # Esiste già
+                
+                try:
+                    with sftp.open(".ssh/authorized_keys", "r") as f:
+                        content = f.read().decode()
+                except IOError:
+                    content = None
+                
+                keys = {line.strip() for line in (content or "").splitlines() if line.strip()}
+                if public_key in keys:
+                    return KeyDistributionResult(
+                        host=hostname,
+                        success=True,
+                        message="Chiave già presente",
+                        already_present=True
+                    )
+                
+                # Aggiunta in coda sul file stesso, non rename di un temporaneo: sui nodi Proxmox
+                # authorized_keys è un symlink a /etc/pve/priv/authorized_keys, condiviso dal cluster
+                line = public_key + "\n"
+                if content and not content.endswith("\n"):
+                    line = "\n" + line
+                with sftp.open(".ssh/authorized_keys", "a") as f:
+                    f.write(line.encode())
+                if content is None:
+                    sftp.chmod(".ssh/authorized_keys", 0o600)
+        finally:
+            sftp.close()
+        
+        return KeyDistributionResult(
+            host=hostname,
+            success=True,
+            message=f"Chiave distribuita con successo (auth: {auth_method})"
+        )
+    
+    def _authorize_key_shell(
+        self,
+        client: paramiko.SSHClient,
+        hostname: str,
+        public_key: str,
+        auth_method: str
+    ) -> KeyDistributionResult:
+        """Come _authorize_key, con un solo comando shell per host senza SFTP"""
+        # Un solo comando: crea ~/.ssh, aggiunge la chiave solo se assente, sistema i permessi
+        quoted_key = shlex.quote(public_key)
+        cmd = (
+            "mkdir -p ~/.ssh && chmod 700 ~/.ssh && "
+            f"if grep -qF {quoted_key} ~/.ssh/authorized_keys 2>/dev/null; then echo present; "
+            f"else printf '%s\\n' {quoted_key} >> ~/.ssh/authorized_keys; fi && "
+            "chmod 600 ~/.ssh/authorized_keys"
+        )
+        stdin, stdout, stderr = client.exec_command(cmd)
+        exit_code = stdout.channel.recv_exit_status()
+        if exit_code != 0:
+            err = stderr.read().decode()
+            return KeyDistributionResult(
+                host=hostname,
+                success=False,
+                message=f"Errore: {err}"
+            )
+        
+        if stdout.read().decode().strip() == "present":
+            return KeyDistributionResult(
+                host=hostname,
+                success=True,
+                message="Chiave già presente",
+                already_present=True
+            )
+        
+        return KeyDistributionResult(
+            host=hostname,
+            success=True,
+            message=f"Chiave distribuita con successo (auth: {auth_method})"
+        )
+    
+    def _write_keypair(self, client: paramiko.SSHClient, private_key: str, public_key: str):
+        """Scrive la coppia di chiavi in /root/.ssh dell'host (bloccante, client già connesso)"""
+        # Crea directory .ssh se non esiste (attende la fine prima di scriverci via SFTP)
+        stdin, stdout, stderr = client.exec_command("mkdir -p ~/.ssh && chmod 700 ~/.ssh")
+        stdout.channel.recv_exit_status()
+        
+        files = [
+            ("/root/.ssh/id_rsa", private_key, 0o600),
+            ("/root/.ssh/id_rsa.pub", public_key + '\n', 0o644),
+        ]
+        
+        try:
+            sftp = client.open_sftp()
+        except paramiko.SSHException:
+            # Sottosistema SFTP non disponibile: scrive i file via stdin di `cat`
+            for remote_path, content, mode in files:
+                stdin, stdout, stderr = client.exec_command(
+                    f"umask 077; cat > {remote_path} && chmod {mode:o} {remote_path}"
+                )
+                stdin.write(content)
+                stdin.channel.shutdown_write()
+                if stdout.channel.recv_exit_status() != 0:
+                    raise RuntimeError(stderr.read().decode())
+            return
+        
+        # putfo invia le scritture in pipeline invece di un round-trip per ogni write()
+        try:
+            sftp.get_channel().settimeout(30)
+            for remote_path, content, mode in files:
+                sftp.putfo(BytesIO(content.encode()), remote_path)
+                sftp.chmod(remote_path, mode)
+        finally:
+            sftp.close()
+    
     async def distribute_key_to_host(
         self,
         hostname: str,
         port: int = 22,
         username: str = "root",
         password: str = None,
-        key_path: str = None
+        key_path: str = None,
+        public_key: Optional[str] = None
     ) -> KeyDistributionResult:
-        """Distribuisce la chiave pubblica a un host remoto"""
+        """
+        Distribuisce la chiave pubblica a un host remoto.
+        
+        public_key, se fornita (es. già letta per un gruppo di nodi), evita di rileggere il file.
+        """
         key_path = key_path or self.DEFAULT_KEY_PATH
         pub_key_path = f"{key_path}.pub"
         
-        if not os.path.exists(pub_key_path):
+        try:
+            if public_key is None:
+                with open(pub_key_path, 'r') as f:
+                    public_key = f.read().strip()
+        except FileNotFoundError:
             return KeyDistributionResult(
                 host=hostname,
                 success=False,
@@ -152,81 +414,38 @@ class SSHKeyService:
             )
         
         try:
-            with open(pub_key_path, 'r') as f:
-                public_key = f.read().strip()
             
             def _distribute():
-                client = paramiko.SSHClient()
-                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                # Prima prova con la chiave esistente (connessione dal pool condiviso)
+                connected = False
+                try:
+                    with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                        connected = True
+                        return self._authorize_key(client, hostname, public_key, "key")
+                except Exception:
+                    # Fallback a password se fornita (solo se la connessione con chiave è fallita)
+                    if connected or not password:
+                        raise
                 
+                # Connessione con password: temporanea, non entra nel pool
+                client = new_ssh_client(self.known_hosts_path, self.strict)
                 try:
-                    # Prima prova con la chiave esistente
-                    try:
-                        client.connect(
-                            hostname=hostname,
-                            port=port,
-                            username=username,
-                            key_filename=key_path,
-                            timeout=10
-                        )
-                        auth_method = "key"
-                    except Exception:
-                        # Fallback a password se fornita
-                        if password:
-                            client.connect(
-                                hostname=hostname,
-                                port=port,
-                                username=username,
-                                password=password,
-                                timeout=10
-                            )
-                            auth_method = "password"
-                        else:
-                            raise
-                    
-                    # Verifica se la chiave è già presente
-                    stdin, stdout, stderr = client.exec_command(
-                        f"grep -F '{public_key}' ~/.ssh/authorized_keys 2>/dev/null"
-                    )
-                    if stdout.read().decode().strip():
-                        return KeyDistributionResult(
-                            host=hostname,
-                            success=True,
-                            message="Chiave già presente",
-                            already_present=True
-                        )
-                    
-                    # Aggiungi la chiave
-                    commands = [
-                        "mkdir -p ~/.ssh",
-                        "chmod 700 ~/.ssh",
-                        f"echo '{public_key}' >> ~/.ssh/authorized_keys",
-                        "chmod 600 ~/.ssh/authorized_keys",
-                        "sort -u ~/.ssh/authorized_keys -o ~/.ssh/authorized_keys"  # Rimuovi duplicati
-                    ]
-                    
-                    for cmd in commands:
-                        stdin, stdout, stderr = client.exec_command(cmd)
-                        exit_code = stdout.channel.recv_exit_status()
-                        if exit_code != 0:
-                            err = stderr.read().decode()
-                            return KeyDistributionResult(
-                                host=hostname,
-                                success=False,
-                                message=f"Errore: {err}"
-                            )
-                    
-                    return KeyDistributionResult(
-                        host=hostname,
-                        success=True,
-                        message=f"Chiave distribuita con successo (auth: {auth_method})"
+                    client.connect(
+                        hostname=hostname,
+                        port=port,
+                        username=username,
+                        password=password,
+                        **CONNECT_TIMEOUTS,
+                        look_for_keys=False,
+                        allow_agent=False
                     )
-                    
+                    client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
+                    return self._authorize_key(client, hostname, public_key, "password")
                 finally:
                     client.close()
                     
             loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, _distribute)
+            return await loop.run_in_executor(self._executor, _distribute)
             
         except Exception as e:
             logger.error(f"Errore distribuzione chiave a {hostname}: {e}")
@@ -246,23 +465,23 @@ class SSHKeyService:
         """Testa l'autenticazione via chiave SSH"""
         key_path = key_path or self.DEFAULT_KEY_PATH
         
-        if not os.path.exists(key_path):
+        if self._stat_pair(key_path)[0] is None:
             return False, "Chiave privata non trovata"
         
         def _test():
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client = new_ssh_client(self.known_hosts_path, self.strict)
             
             try:
                 client.connect(
                     hostname=hostname,
                     port=port,
                     username=username,
-                    key_filename=key_path,
-                    timeout=10,
+                    pkey=ssh_pool.get_pkey(key_path),
+                    **CONNECT_TIMEOUTS,
                     look_for_keys=False,
                     allow_agent=False
                 )
+                client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
                 
                 stdin, stdout, stderr = client.exec_command("hostname && whoami")
                 exit_code = stdout.channel.recv_exit_status()
@@ -281,7 +500,7 @@ class SSHKeyService:
                 client.close()
         
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _test)
+        return await loop.run_in_executor(self._executor, _test)
     
     async def distribute_key_to_all_nodes(
         self,
@@ -289,36 +508,62 @@ class SSHKeyService:
         password: str = None,
         key_path: str = None
     ) -> List[KeyDistributionResult]:
-        """Distribuisce la chiave a tutti i nodi"""
-        results = []
+        """Distribuisce la chiave a tutti i nodi (in parallelo)"""
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_SSH)
         
-        for node in nodes:
-            result = await self.distribute_key_to_host(
-                hostname=node.get('host') or node.get('ip'),
-                port=node.get('port', 22),
-                username=node.get('username', 'root'),
-                password=password,
-                key_path=key_path
-            )
-            results.append(result)
+        # Chiave pubblica letta una volta per tutti i nodi (se assente ci pensa distribute_key_to_host)
+        public_key = None
+        pub_key_path = f"{key_path or self.DEFAULT_KEY_PATH}.pub"
+        try:
+            with open(pub_key_path, 'r') as f:
+                public_key = f.read().strip()
+        except FileNotFoundError:
+            pass
         
-        return results
+        async def _distribute_one(node: Dict) -> KeyDistributionResult:
+            async with semaphore:
+                return await self.distribute_key_to_host(
+                    hostname=node.get('host') or node.get('ip'),
+                    port=node.get('port', 22),
+                    username=node.get('username', 'root'),
+                    password=password,
+                    key_path=key_path,
+                    public_key=public_key
+                )
+        
+        results = await asyncio.gather(*(_distribute_one(node) for node in nodes), return_exceptions=True)
+        
+        return [
+            result if not isinstance(result, BaseException) else KeyDistributionResult(
+                host=node.get('host') or node.get('ip'),
+                success=False,
+                message=str(result)
+            )
+            for node, result in zip(nodes, results)
+        ]
     
     async def test_all_nodes(
         self,
         nodes: List[Dict],
         key_path: str = None
     ) -> List[Dict]:
-        """Testa la connettività SSH a tutti i nodi"""
-        results = []
+        """Testa la connettività SSH a tutti i nodi (in parallelo)"""
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_SSH)
         
-        for node in nodes:
-            success, message = await self.test_key_auth(
-                hostname=node.get('host') or node.get('ip'),
-                port=node.get('port', 22),
-                username=node.get('username', 'root'),
-                key_path=key_path
-            )
+        async def _test_one(node: Dict) -> Tuple[bool, str]:
+            async with semaphore:
+                return await self.test_key_auth(
+                    hostname=node.get('host') or node.get('ip'),
+                    port=node.get('port', 22),
+                    username=node.get('username', 'root'),
+                    key_path=key_path
+                )
+        
+        outcomes = await asyncio.gather(*(_test_one(node) for node in nodes), return_exceptions=True)
+        
+        results = []
+        for node, outcome in zip(nodes, outcomes):
+            success, message = (False, str(outcome)) if isinstance(outcome, BaseException) else outcome
             results.append({
                 "node_id": node.get('id'),
                 "node_name": node.get('name'),
@@ -334,22 +579,32 @@ class SSHKeyService:
         auth_keys_path = self.DEFAULT_AUTHORIZED_KEYS
         keys = []
         
-        if not os.path.exists(auth_keys_path):
+        try:
+            mtime = os.stat(auth_keys_path).st_mtime_ns
+        except FileNotFoundError:
             return keys
         
         try:
-            with open(auth_keys_path, 'r') as f:
-                for i, line in enumerate(f):
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split()
-                        keys.append({
-                            "index": i,
-                            "type": parts[0] if len(parts) > 0 else "unknown",
-                            "key": parts[1][:50] + "..." if len(parts) > 1 and len(parts[1]) > 50 else (parts[1] if len(parts) > 1 else ""),
-                            "comment": parts[2] if len(parts) > 2 else "",
-                            "full_key": line
-                        })
+            cached = self._authorized_keys_cache.get(auth_keys_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            
+            with open(auth_keys_path, 'rb') as f:
+                data = f.read()
+            
+            # Un'unica lettura; un solo match della regex per riga (tipo, chiave, commento)
+            keys = [
+                {
+                    "index": i,
+                    "type": m[1].decode(),
+                    "key": (m[2][:50] + b"..." if len(m[2]) > 50 else m[2]).decode() if m[2] else "",
+                    "comment": (m[3] or b"").decode(),
+                    "full_key": line.decode()
+                }
+                for i, raw_line in enumerate(data.splitlines())
+                if (line := raw_line.strip()) and not line.startswith(b"#") and (m := _PUBKEY_RE.match(line))
+            ]
+            self._authorized_keys_cache[auth_keys_path] = (mtime, keys)
         except Exception as e:
             logger.error(f"Errore lettura authorized_keys: {e}")
         
@@ -367,37 +622,21 @@ class SSHKeyService:
         key_path = key_path or self.DEFAULT_KEY_PATH
         
         def _remove():
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
             try:
-                client.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    key_filename=key_path,
-                    timeout=10
-                )
-                
-                # Escape della chiave per sed
-                escaped_key = key_to_remove.replace('/', '\\/').replace('+', '\\+')
-                
-                cmd = f"sed -i '/{escaped_key}/d' ~/.ssh/authorized_keys"
-                stdin, stdout, stderr = client.exec_command(cmd)
-                exit_code = stdout.channel.recv_exit_status()
-                
-                if exit_code == 0:
-                    return True, "Chiave rimossa con successo"
-                else:
-                    return False, stderr.read().decode()
+                with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                    stdin, stdout, stderr = client.exec_command(_remove_key_command(key_to_remove))
+                    exit_code = stdout.channel.recv_exit_status()
+                    
+                    if exit_code == 0:
+                        return True, "Chiave rimossa con successo"
+                    else:
+                        return False, stderr.read().decode()
                     
             except Exception as e:
                 return False, str(e)
-            finally:
-                client.close()
         
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _remove)
+        return await loop.run_in_executor(self._executor, _remove)
     
     async def copy_keypair_to_host(
         self,
@@ -411,60 +650,27 @@ class SSHKeyService:
         Questo permette all'host di usare la stessa chiave per connettersi ad altri nodi.
         """
         key_path = key_path or self.DEFAULT_KEY_PATH
-        pub_key_path = f"{key_path}.pub"
         
-        if not os.path.exists(key_path) or not os.path.exists(pub_key_path):
+        stats = self._stat_pair(key_path)
+        if None in stats:
             return False, "Chiavi locali non trovate"
         
         try:
             # Leggi le chiavi locali
-            with open(key_path, 'r') as f:
-                private_key = f.read()
-            with open(pub_key_path, 'r') as f:
-                public_key = f.read().strip()
+            private_key, public_key = self._load_keys(key_path, stats)
             
             def _copy():
-                client = paramiko.SSHClient()
-                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                
                 try:
-                    client.connect(
-                        hostname=hostname,
-                        port=port,
-                        username=username,
-                        key_filename=key_path,
-                        timeout=10
-                    )
-                    
-                    # Crea directory .ssh se non esiste
-                    client.exec_command("mkdir -p ~/.ssh && chmod 700 ~/.ssh")
-                    
-                    # Usa SFTP per copiare i file
-                    sftp = client.open_sftp()
-                    
-                    # Scrivi chiave privata
-                    remote_key_path = f"/root/.ssh/id_rsa"
-                    with sftp.file(remote_key_path, 'w') as f:
-                        f.write(private_key)
-                    sftp.chmod(remote_key_path, 0o600)
-                    
-                    # Scrivi chiave pubblica
-                    remote_pub_path = f"/root/.ssh/id_rsa.pub"
-                    with sftp.file(remote_pub_path, 'w') as f:
-                        f.write(public_key + '\n')
-                    sftp.chmod(remote_pub_path, 0o644)
-                    
-                    sftp.close()
+                    with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                        self._write_keypair(client, private_key, public_key)
                     
                     return True, "Coppia di chiavi copiata con successo"
                     
                 except Exception as e:
                     return False, str(e)
-                finally:
-                    client.close()
             
             loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, _copy)
+            return await loop.run_in_executor(self._executor, _copy)
             
         except Exception as e:
             logger.error(f"Errore copia chiavi a {hostname}: {e}")
@@ -481,44 +687,79 @@ class SSHKeyService:
         
         Questo permette a ogni nodo di connettersi a ogni altro nodo.
         """
-        results = []
         key_path = key_path or self.DEFAULT_KEY_PATH
         
+        keys = None
+        error = "Chiavi locali non trovate"
+        stats = self._stat_pair(key_path)
+        if None not in stats:
+            try:
+                keys = self._load_keys(key_path, stats)
+            except Exception as e:
+                error = str(e)
+        
+        results = []
         for node in nodes:
-            hostname = node.get('host') or node.get('ip')
-            port = node.get('port', 22)
-            username = node.get('username', 'root')
-            
-            # Step 1: Copia la coppia di chiavi
-            copy_success, copy_msg = await self.copy_keypair_to_host(
-                hostname=hostname,
-                port=port,
-                username=username,
-                key_path=key_path
-            )
-            
-            # Step 2: Aggiungi chiave pubblica agli authorized_keys
-            dist_result = await self.distribute_key_to_host(
-                hostname=hostname,
-                port=port,
-                username=username,
-                key_path=key_path
-            )
-            
-            results.append({
-                "node_id": node.get('id'),
-                "node_name": node.get('name'),
-                "host": hostname,
-                "keypair_copied": copy_success,
-                "keypair_message": copy_msg,
-                "authorized": dist_result.success,
-                "auth_message": dist_result.message,
-                "success": copy_success and dist_result.success
-            })
+            if keys:
+                results.append(await self._mesh_setup_one(node, key_path, *keys))
+            else:
+                results.append(self._mesh_result(node, (False, error), KeyDistributionResult(
+                    host=node.get('host') or node.get('ip'), success=False, message=error
+                )))
         
         return results
+    
+    async def _mesh_setup_one(
+        self,
+        node: Dict,
+        key_path: str,
+        private_key: str,
+        public_key: str
+    ) -> Dict:
+        """Copia la coppia di chiavi e autorizza la chiave pubblica su un nodo, con una sola connessione"""
+        hostname = node.get('host') or node.get('ip')
+        port = node.get('port', 22)
+        username = node.get('username', 'root')
+        
+        def _setup():
+            copy_result = (False, "")
+            try:
+                with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                    # Step 1: Copia la coppia di chiavi
+                    try:
+                        self._write_keypair(client, private_key, public_key)
+                        copy_result = (True, "Coppia di chiavi copiata con successo")
+                    except Exception as e:
+                        copy_result = (False, str(e))
+                    
+                    # Step 2: Aggiungi chiave pubblica agli authorized_keys (stessa connessione)
+                    dist_result = self._authorize_key(client, hostname, public_key, "key")
+            except Exception as e:
+                logger.error(f"Errore setup mesh SSH su {hostname}: {e}")
+                if not copy_result[0]:
+                    copy_result = (False, str(e))
+                dist_result = KeyDistributionResult(host=hostname, success=False, message=str(e))
+            
+            return self._mesh_result(node, copy_result, dist_result)
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, _setup)
+    
+    def _mesh_result(self, node: Dict, copy_result: Tuple[bool, str], dist_result: KeyDistributionResult) -> Dict:
+        """Risultato del setup mesh per un nodo"""
+        copy_success, copy_msg = copy_result
+        return {
+            "node_id": node.get('id'),
+            "node_name": node.get('name'),
+            "host": node.get('host') or node.get('ip'),
+            "keypair_copied": copy_success,
+            "keypair_message": copy_msg,
+            "authorized": dist_result.success,
+            "auth_message": dist_result.message,
+            "success": copy_success and dist_result.success
+        }
 
 
 # Singleton instance
-ssh_key_service = SSHKeyService()
+ssh_key_service = SSHKeyService(known_hosts_path=KNOWN_HOSTS_PATH, strict=bool(KNOWN_HOSTS_PATH))
 
@@ -3,13 +3,42 @@ SSH Service - Gestione connessioni SSH ai nodi Proxmox
 """
 
 import asyncio
+import codecs
+import os
+import re
+import select
+import socket
+import threading
+import time
 import paramiko
-from typing import Optional, Tuple, List, Dict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Dict, Iterator, AsyncIterator
 import logging
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
+# Comandi SSH in esecuzione contemporaneamente (una sync può occupare un thread per ore)
+MAX_SSH_WORKERS = 64
+
+# Limiti di tempo per ogni fase della connessione (TCP, banner, autenticazione, apertura canale):
+# un host irraggiungibile non tiene occupato un thread per minuti
+CONNECT_TIMEOUTS = {"timeout": 10, "banner_timeout": 10, "auth_timeout": 15, "channel_timeout": 30}
+
+# Intervallo keepalive: rileva le connessioni cadute (es. NAT) anche quando sono ferme
+KEEPALIVE_SECONDS = 30
+
+# known_hosts con le host key attese: se impostato le connessioni a host sconosciuti sono rifiutate
+KNOWN_HOSTS_PATH = os.environ.get("SANOID_MANAGER_KNOWN_HOSTS") or None
+
+# Dimensione dei blocchi letti dal canale SSH
+RECV_CHUNK_SIZE = 65536
+
+# Riga di "zfs list -H -t snapshot -o name,used,creation": dataset@snapshot, used, creation
+_SNAP_RE = re.compile(r"^([^@\t]+)@([^\t]+)\t([^\t]+)\t([^\t\n]+)$", re.M)
+
 
 @dataclass
 class SSHResult:
@@ -20,52 +49,237 @@ class SSHResult:
     exit_code: int
 
 
-class SSHService:
-    """Servizio per eseguire comandi via SSH sui nodi Proxmox"""
+def _is_active(client: paramiko.SSHClient) -> bool:
+    """Verifica se la connessione è ancora attiva"""
+    try:
+        transport = client.get_transport()
+        return bool(transport and transport.is_active())
+    except Exception:
+        return False
+
+
+class _SkipHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    """Accetta la host key senza registrarla (nessun aggiornamento di known_hosts)"""
     
-    def __init__(self):
-        self._connections: Dict[str, paramiko.SSHClient] = {}
+    def missing_host_key(self, client, hostname, key):
+        pass
+
+
+def new_ssh_client(known_hosts_path: Optional[str] = None, strict: bool = False) -> paramiko.SSHClient:
+    """
+    Crea un client SSH con la politica sulle host key richiesta.
     
-    def _get_client(
-        self, 
-        hostname: str, 
-        port: int = 22,
-        username: str = "root",
-        key_path: str = "/root/.ssh/id_rsa"
-    ) -> paramiko.SSHClient:
-        """Ottiene o crea una connessione SSH"""
-        key = f"{username}@{hostname}:{port}"
-        
-        if key in self._connections:
-            client = self._connections[key]
-            # Verifica se la connessione è ancora attiva
-            try:
-                transport = client.get_transport()
-                if transport and transport.is_active():
-                    return client
-            except:
-                pass
-            # Connessione non attiva, la rimuoviamo
-            del self._connections[key]
-        
-        # Crea nuova connessione
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    strict=True: solo host presenti in known_hosts_path (RejectPolicy).
+    strict=False: host key accettate senza essere registrate (es. setup iniziale del mesh).
+    """
+    client = paramiko.SSHClient()
+    if strict:
+        if known_hosts_path:
+            # Caricate come chiavi "di sistema": il file non viene mai riscritto
+            client.load_system_host_keys(known_hosts_path)
+        client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    else:
+        client.set_missing_host_key_policy(_SkipHostKeyPolicy())
+    return client
+
+
+def _recv_both(chan: paramiko.Channel, timeout: Optional[float]) -> Tuple[str, str]:
+    """
+    Legge stdout e stderr del canale insieme, a blocchi, fino a EOF.
+    
+    Nessuno dei due flussi può riempire la finestra SSH e bloccare il comando mentre
+    si legge l'altro. timeout è il tempo massimo senza nuovo output su entrambi i flussi
+    (socket.timeout se superato), non la durata complessiva del comando.
+    """
+    out, err = bytearray(), bytearray()
+    while True:
+        while chan.recv_ready():
+            out.extend(chan.recv(RECV_CHUNK_SIZE))
+        while chan.recv_stderr_ready():
+            err.extend(chan.recv_stderr(RECV_CHUNK_SIZE))
+        if (chan.eof_received or chan.closed) and not chan.recv_ready() and not chan.recv_stderr_ready():
+            break
+        # fileno() del canale segnala dati su stdout o stderr (ed EOF)
+        readable, _, _ = select.select([chan], [], [], timeout)
+        if not readable:
+            raise socket.timeout(f"Nessun output per {timeout}s")
+    return out.decode('utf-8', errors='replace'), err.decode('utf-8', errors='replace')
+
+
+class SSHConnectionPool:
+    """
+    Pool condiviso di connessioni SSH autenticate con chiave.
+    
+    Una connessione per (utente, host, porta, chiave), riusata per più comandi
+    (ogni comando apre solo un nuovo canale sullo stesso transport).
+    Limitato a max_size connessioni con espulsione LRU di quelle inattive.
+    """
+    
+    def __init__(
+        self,
+        max_size: int = 64,
+        keepalive: int = KEEPALIVE_SECONDS,
+        known_hosts_path: Optional[str] = None,
+        strict: bool = False
+    ):
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self.known_hosts_path = known_hosts_path
+        self.strict = strict
+        # chiave -> [client, ultimo utilizzo, utilizzi in corso], in ordine LRU
+        self._entries: "OrderedDict[Tuple[str, str, int, str], list]" = OrderedDict()
+        self._lock = threading.Lock()
+        # percorso -> (mtime_ns, chiave privata già decodificata)
+        self._pkeys: Dict[str, Tuple[int, paramiko.PKey]] = {}
+        self._pkeys_lock = threading.Lock()
+    
+    def get_pkey(self, key_path: str) -> paramiko.PKey:
+        """Carica la chiave privata una sola volta (ricaricata se il file cambia)"""
+        mtime = os.stat(key_path).st_mtime_ns
+        with self._pkeys_lock:
+            cached = self._pkeys.get(key_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            
+            # from_path riconosce il tipo (ed25519, ecdsa, rsa) e l'eventuale certificato
+            pkey = paramiko.PKey.from_path(key_path)
+            self._pkeys[key_path] = (mtime, pkey)
+            return pkey
+    
+    def _connect(self, hostname: str, port: int, username: str, key_path: str) -> paramiko.SSHClient:
+        """Apre una nuova connessione SSH"""
+        client = new_ssh_client(self.known_hosts_path, self.strict)
         
         try:
             client.connect(
                 hostname=hostname,
                 port=port,
                 username=username,
-                key_filename=key_path,
-                timeout=10,
-                banner_timeout=10
+                pkey=self.get_pkey(key_path),
+                **CONNECT_TIMEOUTS,
+                # Solo la chiave indicata: niente ricerca in ~/.ssh né interrogazione dell'agent
+                look_for_keys=False,
+                allow_agent=False
             )
-            self._connections[key] = client
-            return client
         except Exception as e:
             logger.error(f"Errore connessione SSH a {hostname}: {e}")
+            client.close()
             raise
+        
+        # Rileva le connessioni cadute (es. NAT) anche quando sono ferme nel pool
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+    
+    def _checkout(self, key: Tuple[str, str, int, str]) -> Optional[list]:
+        """Prende dal pool la connessione per key, se ancora attiva"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if _is_active(entry[0]):
+                entry[2] += 1
+                self._entries.move_to_end(key)
+                return entry
+            # Connessione non attiva, la rimuoviamo
+            del self._entries[key]
+        entry[0].close()
+        return None
+    
+    def _evict(self) -> List[paramiko.SSHClient]:
+        """Rimuove le connessioni inutilizzate meno recenti oltre max_size (con lock acquisito)"""
+        evicted = []
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            if self._entries[key][2] == 0:
+                evicted.append(self._entries.pop(key)[0])
+        return evicted
+    
+    @contextmanager
+    def acquire(
+        self,
+        hostname: str,
+        port: int = 22,
+        username: str = "root",
+        key_path: str = "/root/.ssh/id_rsa"
+    ) -> Iterator[paramiko.SSHClient]:
+        """Fornisce una connessione dal pool (bloccante: da usare nei thread dell'executor)"""
+        key = (username, hostname, port, key_path)
+        entry = self._checkout(key)
+        pooled = True
+        evicted = []
+        
+        if entry is None:
+            # Connessione fuori dal lock: gli handshake verso host diversi procedono in parallelo
+            client = self._connect(hostname, port, username, key_path)
+            entry = [client, time.monotonic(), 1]
+            with self._lock:
+                if key in self._entries:
+                    # Un altro thread ha già aperto la stessa connessione: questa resta temporanea
+                    pooled = False
+                else:
+                    self._entries[key] = entry
+                    evicted = self._evict()
+        
+        for old in evicted:
+            old.close()
+        
+        try:
+            yield entry[0]
+        finally:
+            if pooled:
+                with self._lock:
+                    entry[1] = time.monotonic()
+                    entry[2] -= 1
+            else:
+                entry[0].close()
+    
+    async def close_idle(self, ttl: int = 300):
+        """Chiude le connessioni inutilizzate da più di ttl secondi"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                key for key, (client, last_used, in_use) in self._entries.items()
+                if in_use == 0 and (now - last_used > ttl or not _is_active(client))
+            ]
+            clients = [self._entries.pop(key)[0] for key in idle]
+        
+        if clients:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: [c.close() for c in clients])
+            logger.debug(f"Pool SSH: chiuse {len(clients)} connessioni inattive")
+    
+    async def run_idle_reaper(self, interval: int = 60, ttl: int = 300):
+        """Task in background: chiude periodicamente le connessioni inattive"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.close_idle(ttl)
+            except Exception as e:
+                logger.warning(f"Errore pulizia pool SSH: {e}")
+    
+    def close_all(self):
+        """Chiude tutte le connessioni"""
+        with self._lock:
+            clients = [entry[0] for entry in self._entries.values()]
+            self._entries.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+# Pool condiviso da SSHService e SSHKeyService
+ssh_pool = SSHConnectionPool(known_hosts_path=KNOWN_HOSTS_PATH, strict=bool(KNOWN_HOSTS_PATH))
+
+
+class SSHService:
+    """Servizio per eseguire comandi via SSH sui nodi Proxmox"""
+    
+    def __init__(self):
+        # Executor dedicato: i comandi lunghi non esauriscono quello di default del loop
+        self._executor = ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS, thread_name_prefix="ssh")
     
     async def execute(
         self,
@@ -76,15 +290,25 @@ class SSHService:
         key_path: str = "/root/.ssh/id_rsa",
         timeout: int = 300
     ) -> SSHResult:
-        """Esegue un comando su un nodo remoto"""
+        """
+        Esegue un comando su un nodo remoto.
+        
+        timeout è il tempo massimo di inattività: il comando fallisce se per timeout
+        secondi non arriva output né su stdout né su stderr (non limita la durata totale).
+        """
         def _execute():
             try:
-                client = self._get_client(hostname, port, username, key_path)
-                stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
-                
-                exit_code = stdout.channel.recv_exit_status()
-                stdout_text = stdout.read().decode('utf-8', errors='replace')
-                stderr_text = stderr.read().decode('utf-8', errors='replace')
+                with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                    chan = stdout.channel
+                    
+                    # Lettura a blocchi di entrambi i flussi prima dell'exit status: il canale
+                    # non resta bloccato con la finestra SSH piena su output molto grandi
+                    try:
+                        stdout_text, stderr_text = _recv_both(chan, timeout)
+                        exit_code = chan.recv_exit_status()
+                    finally:
+                        chan.close()
                 
                 return SSHResult(
                     success=(exit_code == 0),
@@ -101,8 +325,100 @@ class SSHService:
                     exit_code=-1
                 )
         
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, _execute)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _execute)
+    
+    async def execute_stream(
+        self,
+        hostname: str,
+        command: str,
+        port: int = 22,
+        username: str = "root",
+        key_path: str = "/root/.ssh/id_rsa",
+        timeout: int = 300,
+        result: Optional[SSHResult] = None,
+        max_duration: Optional[int] = None
+    ) -> AsyncIterator[str]:
+        """
+        Esegue un comando su un nodo remoto restituendo le righe di output
+        man mano che arrivano (stdout e stderr uniti).
+        Utile per comandi lunghi come sanoid/syncoid.
+        
+        timeout limita solo l'apertura del canale: nessun timeout di inattività in lettura
+        (uno zfs send può restare a lungo senza scrivere nulla). max_duration, se indicato,
+        è il tempo massimo complessivo: superato, il canale viene chiuso e si solleva TimeoutError.
+        result, se fornito, viene aggiornato con exit code ed esito a comando terminato.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        # Canale aperto dal thread, chiuso anche dal consumatore per sbloccare recv()
+        channels: List[paramiko.Channel] = []
+        
+        def _reader():
+            chan = None
+            try:
+                with ssh_pool.acquire(hostname, port, username, key_path) as client:
+                    chan = client.get_transport().open_session(timeout=timeout)
+                    channels.append(chan)
+                    chan.settimeout(None)
+                    chan.set_combine_stderr(True)
+                    chan.exec_command(command)
+                    
+                    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                    pending = ""
+                    while not stop.is_set():
+                        data = chan.recv(RECV_CHUNK_SIZE)
+                        if not data:
+                            break
+                        pending += decoder.decode(data)
+                        *lines, pending = pending.split('\n')
+                        for line in lines:
+                            loop.call_soon_threadsafe(queue.put_nowait, line)
+                    
+                    if stop.is_set():
+                        return
+                    pending += decoder.decode(b"", final=True)
+                    if pending:
+                        loop.call_soon_threadsafe(queue.put_nowait, pending)
+                    exit_code = chan.recv_exit_status()
+                    if result is not None:
+                        result.exit_code = exit_code
+                        result.success = exit_code == 0
+                    if exit_code != 0:
+                        logger.warning(f"Comando su {hostname} terminato con codice {exit_code}")
+            except Exception as e:
+                if not stop.is_set():
+                    logger.error(f"Errore esecuzione comando su {hostname}: {e}")
+                    loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                # Sempre chiuso: un canale abbandonato lascerebbe il comando attivo sul nodo
+                if chan is not None:
+                    chan.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        deadline = loop.time() + max_duration if max_duration else None
+        loop.run_in_executor(self._executor, _reader)
+        try:
+            while True:
+                if deadline is None:
+                    item = await queue.get()
+                else:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"Comando su {hostname} interrotto dopo {max_duration}s")
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Consumatore interrotto o tempo scaduto: chiusura del canale, il thread esce da recv()
+            stop.set()
+            for chan in channels:
+                chan.close()
     
     async def test_connection(
         self,
@@ -163,18 +479,19 @@ class SSHService:
             key_path=key_path
         )
         
-        datasets = []
-        if result.success:
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split('\t')
-                    if len(parts) >= 4:
-                        datasets.append({
-                            "name": parts[0],
-                            "used": parts[1],
-                            "available": parts[2],
-                            "mountpoint": parts[3] if parts[3] != "-" else None
-                        })
+        if not result.success:
+            return []
+        
+        rows = (line.split('\t', 3) for line in result.stdout.split('\n') if line)
+        datasets = [
+            {
+                "name": parts[0],
+                "used": parts[1],
+                "available": parts[2],
+                "mountpoint": parts[3] if parts[3] != "-" else None
+            }
+            for parts in rows if len(parts) >= 4
+        ]
         return datasets
     
     async def get_snapshots(
@@ -198,20 +515,19 @@ class SSHService:
             key_path=key_path
         )
         
-        snapshots = []
-        if result.success:
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split('\t')
-                    if len(parts) >= 3:
-                        name_parts = parts[0].split('@')
-                        snapshots.append({
-                            "full_name": parts[0],
-                            "dataset": name_parts[0] if len(name_parts) > 0 else "",
-                            "snapshot": name_parts[1] if len(name_parts) > 1 else "",
-                            "used": parts[1],
-                            "creation": parts[2]
-                        })
+        if not result.success:
+            return []
+        
+        snapshots = [
+            {
+                "full_name": f"{m[1]}@{m[2]}",
+                "dataset": m[1],
+                "snapshot": m[2],
+                "used": m[3],
+                "creation": m[4]
+            }
+            for m in _SNAP_RE.finditer(result.stdout)
+        ]
         return snapshots
     
     async def create_snapshot(
@@ -257,12 +573,7 @@ class SSHService:
     
     def close_all(self):
         """Chiude tutte le connessioni"""
-        for key, client in self._connections.items():
-            try:
-                client.close()
-            except:
-                pass
-        self._connections.clear()
+        ssh_pool.close_all()
 
 
 # Singleton instance
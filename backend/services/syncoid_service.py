@@ -3,20 +3,123 @@ Syncoid Service - Gestione replica ZFS tra nodi
 """
 
 import asyncio
-from datetime import datetime
-from typing import Optional, Dict, Tuple
+import functools
+from collections import deque
+from typing import Optional, Dict, List, Tuple
 import logging
 import re
+import shlex
+import time
 
 from services.ssh_service import ssh_service, SSHResult
 
 logger = logging.getLogger(__name__)
 
+# Canali aperti insieme sulla stessa connessione (sotto il MaxSessions di default di sshd, 10)
+MAX_SESSIONS_PER_HOST = 8
+
+# Pattern comuni nell'output di syncoid per la quantità trasferita, uniti in una sola
+# alternanza: l'output viene scandito una volta sola
+_SIZE = r"\d+(?:\.\d+)?[KMGT]i?B?"
+_TRANSFERRED_RE = re.compile(
+    rf"(?P<xfer>{_SIZE})\s+transferred|sent\s+(?P<sent>{_SIZE})|(?P<total>{_SIZE})\s+total",
+    re.IGNORECASE
+)
+
+# Parole chiave dei pattern: se nessuna compare nell'output la regex non viene eseguita
+_TRANSFER_MARKERS = ("transferred", "sent", "total")
+
+# Il riepilogo del trasferimento è in fondo all'output: basta cercare negli ultimi byte
+TRANSFER_SUMMARY_TAIL = 8192
+
+# Righe di output di syncoid conservate per il log (le ultime)
+OUTPUT_TAIL_LINES = 2048
+
+# Lunghezza massima degli argomenti di un singolo comando remoto (ben sotto ARG_MAX)
+MAX_COMMAND_ARGS_LENGTH = 65536
+
+
+@functools.lru_cache(maxsize=256)
+def _syncoid_argv(
+    source_host: Optional[str],
+    source_dataset: str,
+    dest_host: Optional[str],
+    dest_dataset: str,
+    source_user: str,
+    dest_user: str,
+    source_port: int,
+    dest_port: int,
+    source_key: str,
+    dest_key: str,
+    recursive: bool,
+    compress: str,
+    mbuffer_size: str,
+    no_sync_snap: bool,
+    force_delete: bool,
+    extra_args: str
+) -> Tuple[str, ...]:
+    """Argomenti del comando syncoid per i parametri dati (memorizzati: stessi parametri, stessa tupla)"""
+    
+    cmd_parts = ["syncoid"]
+    
+    # Opzioni base
+    if recursive:
+        cmd_parts.append("--recursive")
+    
+    if compress and compress != "none":
+        cmd_parts.append(f"--compress={compress}")
+    
+    if mbuffer_size:
+        cmd_parts.append(f"--mbuffer-size={mbuffer_size}")
+    
+    if no_sync_snap:
+        cmd_parts.append("--no-sync-snap")
+    
+    if force_delete:
+        cmd_parts.append("--force-delete")
+    
+    # SSH options (compatibile con tutte le versioni)
+    # Determina quale chiave/porta usare in base a sorgente/destinazione remota
+    if dest_host:
+        # Push a destinazione remota - usa opzioni SSH per la destinazione
+        cmd_parts.append(f"--sshkey={dest_key}")
+        if dest_port != 22:
+            cmd_parts.append(f"--sshport={dest_port}")
+    elif source_host:
+        # Pull da sorgente remota - usa opzioni SSH per la sorgente
+        cmd_parts.append(f"--sshkey={source_key}")
+        if source_port != 22:
+            cmd_parts.append(f"--sshport={source_port}")
+    
+    if extra_args:
+        # Un argomento per ogni opzione extra, così la quotatura vale anche per loro
+        try:
+            cmd_parts.extend(shlex.split(extra_args))
+        except ValueError:
+            cmd_parts.extend(extra_args.split())
+    
+    # Costruisci sorgente
+    if source_host:
+        source = f"{source_user}@{source_host}:{source_dataset}"
+    else:
+        source = source_dataset
+    
+    # Costruisci destinazione
+    if dest_host:
+        dest = f"{dest_user}@{dest_host}:{dest_dataset}"
+    else:
+        dest = dest_dataset
+    
+    cmd_parts.append(source)
+    cmd_parts.append(dest)
+    
+    return tuple(cmd_parts)
+
 
 class SyncoidService:
     """Servizio per replica ZFS con Syncoid"""
     
-    def build_syncoid_command(
+    def build_syncoid_argv(
         self,
         source_host: Optional[str],
         source_dataset: str,
@@ -34,9 +137,9 @@ class SyncoidService:
         no_sync_snap: bool = False,
         force_delete: bool = False,
         extra_args: str = ""
-    ) -> str:
+    ) -> List[str]:
         """
-        Costruisce il comando syncoid.
+        Costruisce gli argomenti del comando syncoid.
         Usa sintassi compatibile con tutte le versioni di syncoid.
         
         Sintassi syncoid:
@@ -45,57 +148,31 @@ class SyncoidService:
         - syncoid user@host:source dest            (remoto -> locale, pull)
         - syncoid user@host:source user@host:dest  (remoto -> remoto)
         """
-        
-        cmd_parts = ["syncoid"]
-        
-        # Opzioni base
-        if recursive:
-            cmd_parts.append("--recursive")
-        
-        if compress and compress != "none":
-            cmd_parts.append(f"--compress={compress}")
-        
-        if mbuffer_size:
-            cmd_parts.append(f"--mbuffer-size={mbuffer_size}")
-        
-        if no_sync_snap:
-            cmd_parts.append("--no-sync-snap")
-        
-        if force_delete:
-            cmd_parts.append("--force-delete")
-        
-        # SSH options (compatibile con tutte le versioni)
-        # Determina quale chiave/porta usare in base a sorgente/destinazione remota
-        if dest_host:
-            # Push a destinazione remota - usa opzioni SSH per la destinazione
-            cmd_parts.append(f"--sshkey={dest_key}")
-            if dest_port != 22:
-                cmd_parts.append(f"--sshport={dest_port}")
-        elif source_host:
-            # Pull da sorgente remota - usa opzioni SSH per la sorgente
-            cmd_parts.append(f"--sshkey={source_key}")
-            if source_port != 22:
-                cmd_parts.append(f"--sshport={source_port}")
-        
-        if extra_args:
-            cmd_parts.append(extra_args)
-        
-        # Costruisci sorgente
-        if source_host:
-            source = f"{source_user}@{source_host}:{source_dataset}"
-        else:
-            source = source_dataset
-        
-        # Costruisci destinazione
-        if dest_host:
-            dest = f"{dest_user}@{dest_host}:{dest_dataset}"
-        else:
-            dest = dest_dataset
-        
-        cmd_parts.append(source)
-        cmd_parts.append(dest)
-        
-        return " ".join(cmd_parts)
+        return list(_syncoid_argv(
+            source_host,
+            source_dataset,
+            dest_host,
+            dest_dataset,
+            source_user,
+            dest_user,
+            source_port,
+            dest_port,
+            source_key,
+            dest_key,
+            recursive,
+            compress,
+            mbuffer_size,
+            no_sync_snap,
+            force_delete,
+            extra_args
+        ))
+    
+    def build_syncoid_command(self, *args, **kwargs) -> str:
+        """
+        Comando syncoid come stringa per la shell remota (stessi parametri di build_syncoid_argv).
+        Ogni argomento è quotato: dataset e opzioni non vengono reinterpretati dalla shell.
+        """
+        return shlex.join(self.build_syncoid_argv(*args, **kwargs))
     
     async def run_sync(
         self,
@@ -119,10 +196,10 @@ class SyncoidService:
         no_sync_snap: bool = False,
         force_delete: bool = False,
         extra_args: str = "",
-        timeout: int = 3600
+        timeout: Optional[int] = None
     ) -> Dict:
         """
-        Esegue una sincronizzazione Syncoid
+        Esegue una sincronizzazione Syncoid (timeout: durata massima in secondi, None = nessun limite)
         
         Returns dict con:
             - success: bool
@@ -132,7 +209,7 @@ class SyncoidService:
             - transferred: str (es: "1.5G")
         """
         
-        start_time = datetime.utcnow()
+        start_time = time.monotonic()
         
         # Costruisci comando
         cmd = self.build_syncoid_command(
@@ -154,23 +231,34 @@ class SyncoidService:
             extra_args=extra_args
         )
         
-        logger.info(f"Esecuzione syncoid: {cmd}")
-        
-        # Esegui comando
-        result = await ssh_service.execute(
-            hostname=executor_host,
-            command=cmd,
-            port=executor_port,
-            username=executor_user,
-            key_path=executor_key,
-            timeout=timeout
-        )
-        
-        end_time = datetime.utcnow()
-        duration = int((end_time - start_time).total_seconds())
+        logger.info("Esecuzione syncoid: %s", cmd)
+        
+        # Esegui comando leggendo l'output man mano: in memoria restano solo le ultime righe
+        result = SSHResult(success=False, stdout="", stderr="", exit_code=-1)
+        tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        try:
+            async for line in ssh_service.execute_stream(
+                hostname=executor_host,
+                command=cmd,
+                port=executor_port,
+                username=executor_user,
+                key_path=executor_key,
+                result=result,
+                max_duration=timeout
+            ):
+                tail.append(line)
+        except Exception as e:
+            result.stderr = str(e)
+        
+        # stdout e stderr arrivano uniti: in caso di errore l'output è anche il messaggio d'errore
+        result.stdout = "\n".join(tail)
+        if not result.success and not result.stderr:
+            result.stderr = result.stdout
+        
+        duration = int(time.monotonic() - start_time)
         
         # Parse output per trasferimento
-        transferred = self._parse_transferred(result.stdout + result.stderr)
+        transferred = self._parse_transferred(result.stdout)
         
         return {
             "success": result.success,
@@ -183,19 +271,19 @@ class SyncoidService:
     
     def _parse_transferred(self, output: str) -> Optional[str]:
         """Estrae la quantità di dati trasferiti dall'output di syncoid"""
-        # Pattern comuni nell'output di syncoid
-        patterns = [
-            r"(\d+(?:\.\d+)?[KMGT]i?B?)\s+transferred",
-            r"sent\s+(\d+(?:\.\d+)?[KMGT]i?B?)",
-            r"(\d+(?:\.\d+)?[KMGT]i?B?)\s+total",
-        ]
+        tail = output[-TRANSFER_SUMMARY_TAIL:]
+        lowered = tail.lower()
+        if not any(marker in lowered for marker in _TRANSFER_MARKERS):
+            return None
         
-        for pattern in patterns:
-            match = re.search(pattern, output, re.IGNORECASE)
-            if match:
-                return match.group(1)
+        # Una sola scansione, ma con la priorità storica: "transferred", poi "sent", poi "total"
+        found = {}
+        for match in _TRANSFERRED_RE.finditer(tail):
+            found.setdefault(match.lastgroup, match.group(match.lastgroup))
+            if "xfer" in found:
+                break
         
-        return None
+        return found.get("xfer") or found.get("sent") or found.get("total")
     
     async def verify_datasets_exist(
         self,
@@ -206,19 +294,38 @@ class SyncoidService:
         key_path: str = "/root/.ssh/id_rsa"
     ) -> Dict[str, bool]:
         """Verifica che i dataset esistano su un nodo"""
-        results = {}
-        
+        # Un solo "zfs list" con tutti i dataset: quelli inesistenti finiscono su stderr,
+        # gli altri su stdout (exit code != 0 se ne manca anche solo uno)
+        chunks = []
+        current, length = [], 0
         for ds in datasets:
-            result = await ssh_service.execute(
-                hostname=hostname,
-                command=f"zfs list -H -o name {ds} 2>/dev/null",
-                port=port,
-                username=username,
-                key_path=key_path
-            )
-            results[ds] = result.success and ds in result.stdout
-        
-        return results
+            quoted = shlex.quote(ds)
+            if current and length + len(quoted) + 1 > MAX_COMMAND_ARGS_LENGTH:
+                chunks.append(current)
+                current, length = [], 0
+            current.append(quoted)
+            length += len(quoted) + 1
+        if current:
+            chunks.append(current)
+        
+        # Liste molto lunghe: più comandi, in parallelo sulla stessa connessione del pool
+        semaphore = asyncio.Semaphore(MAX_SESSIONS_PER_HOST)
+        
+        async def _list(args: list) -> SSHResult:
+            async with semaphore:
+                return await ssh_service.execute(
+                    hostname=hostname,
+                    command="zfs list -H -o name " + " ".join(args),
+                    port=port,
+                    username=username,
+                    key_path=key_path
+                )
+        
+        existing = set()
+        for result in await asyncio.gather(*(_list(chunk) for chunk in chunks)):
+            existing.update(result.stdout.split('\n'))
+        
+        return {ds: ds in existing for ds in datasets}
     
     async def create_dataset(
         self,
@@ -256,45 +363,42 @@ class SyncoidService:
     ) -> Optional[str]:
         """Trova l'ultimo snapshot comune tra sorgente e destinazione"""
         
-        # Ottieni snapshot sorgente
-        source_result = await ssh_service.execute(
-            hostname=source_host,
-            command=f"zfs list -H -t snapshot -o name -s creation {source_dataset}",
-            port=source_port,
-            username=source_user,
-            key_path=source_key
+        # Snapshot di sorgente e destinazione richiesti in parallelo
+        source_result, dest_result = await asyncio.gather(
+            ssh_service.execute(
+                hostname=source_host,
+                command=f"zfs list -H -t snapshot -o name -s creation {source_dataset}",
+                port=source_port,
+                username=source_user,
+                key_path=source_key
+            ),
+            ssh_service.execute(
+                hostname=dest_host,
+                command=f"zfs list -H -t snapshot -o name -s creation {dest_dataset}",
+                port=dest_port,
+                username=dest_user,
+                key_path=dest_key
+            )
         )
         
-        if not source_result.success:
+        if not source_result.success or not dest_result.success:
             return None
         
-        source_snaps = set()
-        for line in source_result.stdout.strip().split('\n'):
-            if '@' in line:
-                snap_name = line.split('@')[1]
-                source_snaps.add(snap_name)
-        
-        # Ottieni snapshot destinazione
-        dest_result = await ssh_service.execute(
-            hostname=dest_host,
-            command=f"zfs list -H -t snapshot -o name -s creation {dest_dataset}",
-            port=dest_port,
-            username=dest_user,
-            key_path=dest_key
+        # rpartition: solo il nome dello snapshot, senza costruire liste per ogni riga
+        source_snaps = frozenset(
+            snap_name
+            for line in source_result.stdout.splitlines()
+            for _, sep, snap_name in (line.rpartition('@'),)
+            if sep
         )
         
-        if not dest_result.success:
-            return None
-        
-        dest_snaps = []
-        for line in dest_result.stdout.strip().split('\n'):
-            if '@' in line:
-                snap_name = line.split('@')[1]
-                if snap_name in source_snaps:
-                    dest_snaps.append(snap_name)
+        # Ritorna l'ultimo comune (il più recente per creation time): scansione dal fondo
+        for line in reversed(dest_result.stdout.splitlines()):
+            _, sep, snap_name = line.rpartition('@')
+            if sep and snap_name in source_snaps:
+                return snap_name
         
-        # Ritorna l'ultimo comune (il più recente per creation time)
-        return dest_snaps[-1] if dest_snaps else None
+        return None
 
 
 # Singleton
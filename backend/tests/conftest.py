@@ -2,36 +2,66 @@
 Pytest Configuration e Fixtures
 """
 
+import functools
 import pytest
+import pytest_asyncio
+import httpx
 import os
 import tempfile
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import StaticPool
 
-# Set test environment
+# Ambiente di test
 os.environ["SANOID_MANAGER_DB"] = ":memory:"
 os.environ["SANOID_MANAGER_SECRET_KEY"] = "test-secret-key-for-testing-only"
+# Costo bcrypt minimo: l'hashing è lento di proposito e non è ciò che i test verificano
+os.environ["SANOID_MANAGER_BCRYPT_ROUNDS"] = "4"
 
 from database import Base, get_db, User, Node, SyncJob, Dataset
 from main import app
 from services.auth_service import auth_service
 
 
-# Test database setup
+# Database di test
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
+    future=True,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+# pysqlite gestisce da sé BEGIN/COMMIT e ignora i SAVEPOINT:
+# transazioni emesse esplicitamente, così il rollback per test funziona
+@event.listens_for(engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine, "connect")
+def _fast_pragmas(dbapi_connection, connection_record):
+    # Database usa e getta: niente sync, journal e tabelle temporanee in memoria.
+    # foreign_keys resta disattivato come sull'engine dell'app: attivarlo solo qui
+    # verificherebbe vincoli che in produzione non sono applicati
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA journal_mode=MEMORY")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+@event.listens_for(engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
 def override_get_db():
-    """Override database dependency for testing"""
+    """Dipendenza database sostituita per i test"""
     db = TestingSessionLocal()
     try:
         yield db
@@ -41,140 +71,276 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+# Hash delle password degli utenti di test, calcolati una volta per sessione
+ADMIN_PASSWORD_HASH = auth_service.get_password_hash("Admin123!")
+OPERATOR_PASSWORD_HASH = auth_service.get_password_hash("Operator123!")
+VIEWER_PASSWORD_HASH = auth_service.get_password_hash("Viewer123!")
+
+# Utenti di test, inseriti una volta per sessione (i token sono firmati per questi id fissi)
+TEST_USERS = {
+    "admin": {"id": 1, "username": "admin", "role": "admin",
+              "full_name": "Test Admin", "password_hash": ADMIN_PASSWORD_HASH},
+    "operator": {"id": 2, "username": "operator", "role": "operator",
+                 "full_name": "Test Operator", "password_hash": OPERATOR_PASSWORD_HASH},
+    "viewer": {"id": 3, "username": "viewer", "role": "viewer",
+               "full_name": "Test Viewer", "password_hash": VIEWER_PASSWORD_HASH},
+}
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    """Crea lo schema del database una volta per sessione"""
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="session")
+def db_connection(schema):
+    """Connessione unica condivisa dalla sessione; ogni test gira in una sua transazione su di essa"""
+    connection = engine.connect()
+    # Anche le sessioni aperte dall'app (override_get_db) entrano nella transazione del test
+    TestingSessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    yield connection
+    TestingSessionLocal.configure(bind=engine)
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def seed_data(db_connection):
+    """
+    Righe di esempio condivise da tutta la sessione, scritte una volta in una
+    transazione esterna annullata a fine sessione
+    """
+    transaction = db_connection.begin()
+    session = Session(bind=db_connection, join_transaction_mode="rollback_only")
+    session.add_all([
+        User(
+            id=user["id"],
+            username=user["username"],
+            email=f"{user['username']}@test.com",
+            password_hash=user["password_hash"],
+            full_name=user["full_name"],
+            role=user["role"],
+            auth_method="local"
+        )
+        for user in TEST_USERS.values()
+    ])
+    node = Node(
+        name="test-node",
+        hostname="192.168.1.100",
+        ssh_port=22,
+        ssh_user="root",
+        ssh_key_path="/root/.ssh/id_rsa"
+    )
+    dest_node = Node(
+        name="dest-node",
+        hostname="192.168.1.101",
+        ssh_port=22,
+        ssh_user="root",
+        ssh_key_path="/root/.ssh/id_rsa"
+    )
+    # Nodi oltre a quelli di esempio, per i test sul filtro allowed_nodes
+    extra_nodes = [
+        Node(name="other-node", hostname="192.168.1.102"),
+        Node(name="other-node-2", hostname="192.168.1.103"),
+    ]
+    session.add_all([node, dest_node, *extra_nodes])
+    session.flush()
+    
+    # Carica i default del server, poi scollega: i test leggono solo gli attributi
+    for obj in (node, dest_node, *extra_nodes):
+        session.refresh(obj)
+    session.expunge_all()
+    session.close()
+    yield {"node": node, "dest_node": dest_node, "extra_nodes": extra_nodes}
+    transaction.rollback()
+
 
 @pytest.fixture(scope="function")
-def db():
-    """Create fresh database for each test"""
-    Base.metadata.create_all(bind=engine)
+def db(db_connection, seed_data):
+    """
+    Database pulito per ogni test: tutto gira in un savepoint annullato
+    al teardown (i commit diventano savepoint annidati), così le modifiche
+    alle righe di esempio non passano agli altri test.
+    """
+    transaction = db_connection.begin_nested()
     db = TestingSessionLocal()
     yield db
     db.close()
-    Base.metadata.drop_all(bind=engine)
+    transaction.rollback()
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """
+    TestClient unico condiviso da tutta la sessione. Volutamente non usato come
+    context manager: il lifespan dell'app (schema sull'engine dell'app, scheduler,
+    pulizia del pool SSH) non viene mai avviato dai test.
+    """
+    return TestClient(app)
 
 
 @pytest.fixture(scope="function")
-def client(db):
-    """Create test client with fresh database"""
-    Base.metadata.create_all(bind=engine)
-    yield TestClient(app)
-    Base.metadata.drop_all(bind=engine)
+def client(db, app_client):
+    """Client di test con database pulito (le richieste girano nella transazione del test)"""
+    app_client.cookies.clear()
+    return app_client
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def async_app_client():
+    """Client ASGI in-process condiviso dalla sessione (i test usano loop_scope="session")"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_app_client:
+        yield async_app_client
+
+
+@pytest.fixture
+def async_client(db, async_app_client):
+    """Client async con database pulito: le richieste girano sull'event loop del test, senza thread portal"""
+    async_app_client.cookies.clear()
+    return async_app_client
 
 
 @pytest.fixture
 def admin_user(db):
-    """Create an admin user for testing"""
-    user = User(
-        username="admin",
-        email="admin@test.com",
-        password_hash=auth_service.get_password_hash("Admin123!"),
-        full_name="Test Admin",
-        role="admin",
-        auth_method="local"
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    """Utente admin di esempio, collegato alla sessione del test"""
+    return db.get(User, TEST_USERS["admin"]["id"])
 
 
 @pytest.fixture
 def operator_user(db):
-    """Create an operator user for testing"""
-    user = User(
-        username="operator",
-        email="operator@test.com",
-        password_hash=auth_service.get_password_hash("Operator123!"),
-        full_name="Test Operator",
-        role="operator",
-        auth_method="local"
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    """Utente operator di esempio, collegato alla sessione del test"""
+    return db.get(User, TEST_USERS["operator"]["id"])
 
 
 @pytest.fixture
 def viewer_user(db):
-    """Create a viewer user for testing"""
-    user = User(
-        username="viewer",
-        email="viewer@test.com",
-        password_hash=auth_service.get_password_hash("Viewer123!"),
-        full_name="Test Viewer",
-        role="viewer",
-        auth_method="local"
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user
+    """Utente viewer di esempio, collegato alla sessione del test"""
+    return db.get(User, TEST_USERS["viewer"]["id"])
 
 
 @pytest.fixture
-def admin_token(admin_user):
-    """Get JWT token for admin user"""
-    return auth_service.create_access_token(
-        data={
-            "sub": str(admin_user.id),
-            "username": admin_user.username,
-            "role": admin_user.role,
-            "auth_method": admin_user.auth_method
-        }
-    )
+def no_users(db):
+    """Rimuove gli utenti di esempio solo per questo test (scenari di primo setup)"""
+    db.query(User).delete()
+    db.flush()
+
+
+@pytest.fixture(scope="session")
+def make_token():
+    """Factory di access token: payload identici sono firmati una sola volta per sessione"""
+    @functools.lru_cache(maxsize=32)
+    def _sign(payload):
+        return auth_service.create_access_token(data=dict(payload))
+    
+    def _make(**claims):
+        return _sign(frozenset(claims.items()))
+    
+    return _make
 
 
-@pytest.fixture
-def operator_token(operator_user):
-    """Get JWT token for operator user"""
-    return auth_service.create_access_token(
-        data={
-            "sub": str(operator_user.id),
-            "username": operator_user.username,
-            "role": operator_user.role,
-            "auth_method": operator_user.auth_method
-        }
-    )
+@pytest.fixture(scope="session")
+def session_tokens(make_token):
+    """Token JWT degli utenti di test, firmati una volta per sessione"""
+    return {
+        name: make_token(
+            sub=str(user["id"]),
+            username=user["username"],
+            role=user["role"],
+            auth_method="local"
+        )
+        for name, user in TEST_USERS.items()
+    }
 
 
-@pytest.fixture
-def viewer_token(viewer_user):
-    """Get JWT token for viewer user"""
-    return auth_service.create_access_token(
-        data={
-            "sub": str(viewer_user.id),
-            "username": viewer_user.username,
-            "role": viewer_user.role,
-            "auth_method": viewer_user.auth_method
-        }
-    )
+@pytest.fixture(scope="session")
+def admin_token(session_tokens):
+    """Token JWT dell'utente admin"""
+    return session_tokens["admin"]
 
 
-@pytest.fixture
-def auth_headers(admin_token):
-    """Get authorization headers for admin"""
-    return {"Authorization": f"Bearer {admin_token}"}
+@pytest.fixture(scope="session")
+def operator_token(session_tokens):
+    """Token JWT dell'utente operator"""
+    return session_tokens["operator"]
+
+
+@pytest.fixture(scope="session")
+def viewer_token(session_tokens):
+    """Token JWT dell'utente viewer"""
+    return session_tokens["viewer"]
+
+
+@pytest.fixture(scope="session")
+def refresh_token():
+    """Refresh token dell'utente admin (stesso payload emesso dal login)"""
+    return auth_service.create_refresh_token(data={"sub": str(TEST_USERS["admin"]["id"])})
+
+
+@pytest.fixture(scope="session")
+def session_headers(session_tokens):
+    """Header Authorization degli utenti di test, costruiti una volta per sessione"""
+    return {
+        name: {"Authorization": f"Bearer {token}"}
+        for name, token in session_tokens.items()
+    }
+
+
+@pytest.fixture(scope="session")
+def admin_headers(session_headers):
+    """Header Authorization dell'utente admin"""
+    return session_headers["admin"]
+
+
+@pytest.fixture(scope="session")
+def operator_headers(session_headers):
+    """Header Authorization dell'utente operator"""
+    return session_headers["operator"]
+
+
+@pytest.fixture(scope="session")
+def viewer_headers(session_headers):
+    """Header Authorization dell'utente viewer"""
+    return session_headers["viewer"]
+
+
+@pytest.fixture(scope="session")
+def auth_headers(admin_headers):
+    """Header Authorization per admin"""
+    return admin_headers
+
+
+@pytest.fixture(scope="session")
+def sample_node(seed_data):
+    """Nodo di esempio, inserito una volta per sessione"""
+    return seed_data["node"]
+
+
+@pytest.fixture(scope="session")
+def extra_nodes(seed_data):
+    """Nodi diversi da sample_node, inseriti una volta per sessione"""
+    return seed_data["extra_nodes"]
 
 
 @pytest.fixture
-def sample_node(db):
-    """Create a sample node for testing"""
-    node = Node(
-        name="test-node",
-        hostname="192.168.1.100",
-        ssh_port=22,
-        ssh_user="root",
-        ssh_key_path="/root/.ssh/id_rsa"
-    )
-    db.add(node)
-    db.commit()
-    db.refresh(node)
-    return node
+def node_factory(db):
+    """
+    Crea nodi aggiuntivi nella sessione del test; vengono scritti tutti
+    insieme dal flush/commit successivo (gli id sono assegnati allora).
+    """
+    def _make(**kwargs):
+        node = Node(**{"hostname": "192.168.1.200", **kwargs})
+        db.add(node)
+        return node
+    
+    return _make
 
 
 @pytest.fixture
 def sample_dataset(db, sample_node):
-    """Create a sample dataset for testing"""
+    """Crea un dataset di esempio per i test"""
     dataset = Dataset(
         node_id=sample_node.id,
         name="rpool/data/vm-100-disk-0",
@@ -189,24 +355,14 @@ def sample_dataset(db, sample_node):
 
 
 @pytest.fixture
-def sample_sync_job(db, sample_node):
-    """Create a sample sync job for testing"""
-    # Create destination node
-    dest_node = Node(
-        name="dest-node",
-        hostname="192.168.1.101",
-        ssh_port=22,
-        ssh_user="root",
-        ssh_key_path="/root/.ssh/id_rsa"
-    )
-    db.add(dest_node)
-    db.commit()
-    
+def sample_sync_job(db, sample_node, seed_data):
+    """Crea un sync job di esempio (test-node -> dest-node) per i test"""
+    # Per singolo test: un nodo referenziato da un job non potrebbe più essere eliminato
     job = SyncJob(
         name="test-job",
         source_node_id=sample_node.id,
         source_dataset="rpool/data/vm-100-disk-0",
-        dest_node_id=dest_node.id,
+        dest_node_id=seed_data["dest_node"].id,
         dest_dataset="rpool/replica/vm-100-disk-0",
         schedule="0 */4 * * *"
     )
@@ -214,4 +370,3 @@ def sample_sync_job(db, sample_node):
     db.commit()
     db.refresh(job)
     return job
-
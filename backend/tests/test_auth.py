@@ -3,8 +3,7 @@ Test Authentication and Authorization
 """
 
 import pytest
-from fastapi.testclient import TestClient
-from services.auth_service import auth_service
+from services.auth_service import auth_service, BCRYPT_ROUNDS
 
 
 class TestAuthService:
@@ -19,26 +18,25 @@ class TestAuthService:
         assert auth_service.verify_password(password, hashed)
         assert not auth_service.verify_password("wrong", hashed)
     
-    def test_password_strength_valid(self):
-        """Test valid password"""
-        is_valid, msg = auth_service.validate_password_strength("ValidPass1")
-        assert is_valid
-    
-    def test_password_strength_too_short(self):
-        """Test password too short"""
-        is_valid, msg = auth_service.validate_password_strength("Short1")
-        assert not is_valid
-        assert "8 caratteri" in msg
-    
-    def test_password_strength_no_uppercase(self):
-        """Test password without uppercase"""
-        is_valid, msg = auth_service.validate_password_strength("nouppercase1")
-        assert not is_valid
-    
-    def test_password_strength_no_digit(self):
-        """Test password without digit"""
-        is_valid, msg = auth_service.validate_password_strength("NoDigitsHere")
-        assert not is_valid
+    def test_password_hash_test_cost(self):
+        """Test hashes use the low bcrypt cost set by conftest"""
+        hashed = auth_service.get_password_hash("TestPassword123!")
+        
+        assert BCRYPT_ROUNDS == 4
+        assert hashed.split("$")[2] == "04"
+    
+    @pytest.mark.parametrize("password, expected, message", [
+        ("ValidPass1", True, None),
+        ("Short1", False, "8 caratteri"),       # too short
+        ("nouppercase1", False, None),         # no uppercase
+        ("NoDigitsHere", False, None),         # no digit
+    ])
+    def test_password_strength(self, password, expected, message):
+        """Test password strength validation"""
+        is_valid, msg = auth_service.validate_password_strength(password)
+        assert is_valid is expected
+        if message:
+            assert message in msg
     
     def test_create_access_token(self):
         """Test JWT token creation"""
@@ -77,14 +75,14 @@ class TestAuthService:
 class TestSetup:
     """Test initial setup endpoint"""
     
-    def test_setup_required_initially(self, client):
+    def test_setup_required_initially(self, client, no_users):
         """Test setup is required when no users exist"""
         response = client.get("/api/setup-required")
         
         assert response.status_code == 200
         assert response.json()["setup_required"] == True
     
-    def test_initial_setup(self, client):
+    def test_initial_setup(self, client, no_users):
         """Test initial admin setup"""
         response = client.post("/api/auth/setup", json={
             "username": "admin",
@@ -159,16 +157,8 @@ class TestLogin:
 class TestTokenRefresh:
     """Test token refresh endpoint"""
     
-    def test_refresh_token_success(self, client, admin_user):
+    def test_refresh_token_success(self, client, refresh_token):
         """Test successful token refresh"""
-        # First login
-        login_response = client.post("/api/auth/login", json={
-            "username": "admin",
-            "password": "Admin123!"
-        })
-        refresh_token = login_response.json()["refresh_token"]
-        
-        # Refresh
         response = client.post(
             "/api/auth/refresh",
             headers={"Authorization": f"Bearer {refresh_token}"}
@@ -177,11 +167,11 @@ class TestTokenRefresh:
         assert response.status_code == 200
         assert "access_token" in response.json()
     
-    def test_refresh_with_access_token(self, client, admin_token):
+    def test_refresh_with_access_token(self, client, admin_headers):
         """Test refresh fails with access token"""
         response = client.post(
             "/api/auth/refresh",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 401
@@ -190,21 +180,31 @@ class TestTokenRefresh:
 class TestCurrentUser:
     """Test current user endpoint"""
     
-    def test_get_current_user(self, client, admin_user, admin_token):
+    def test_get_current_user(self, client, admin_headers):
         """Test get current user info"""
         response = client.get(
             "/api/auth/me",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
         data = response.json()
         assert data["username"] == "admin"
         assert data["role"] == "admin"
-    
-    def test_get_current_user_no_auth(self, client):
-        """Test get current user without auth"""
-        response = client.get("/api/auth/me")
+
+
+class TestAuthRequired:
+    """Test protected endpoints reject unauthenticated requests"""
+    
+    @pytest.mark.parametrize("path", [
+        "/api/auth/me",
+        "/api/nodes/",
+        "/api/settings/",
+        "/api/sync-jobs/",
+    ])
+    def test_endpoints_require_auth(self, client, path):
+        """Test GET without token returns 401"""
+        response = client.get(path)
         
         assert response.status_code == 401
 
@@ -212,11 +212,11 @@ class TestCurrentUser:
 class TestPasswordChange:
     """Test password change endpoint"""
     
-    def test_change_password_success(self, client, admin_user, admin_token):
+    def test_change_password_success(self, client, admin_headers):
         """Test successful password change"""
         response = client.put(
             "/api/auth/me/password",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "current_password": "Admin123!",
                 "new_password": "NewAdmin123!"
@@ -225,11 +225,11 @@ class TestPasswordChange:
         
         assert response.status_code == 200
     
-    def test_change_password_wrong_current(self, client, admin_user, admin_token):
+    def test_change_password_wrong_current(self, client, admin_headers):
         """Test password change with wrong current"""
         response = client.put(
             "/api/auth/me/password",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "current_password": "WrongPassword",
                 "new_password": "NewAdmin123!"
@@ -238,11 +238,11 @@ class TestPasswordChange:
         
         assert response.status_code == 400
     
-    def test_change_password_weak_new(self, client, admin_user, admin_token):
+    def test_change_password_weak_new(self, client, admin_headers):
         """Test password change with weak new password"""
         response = client.put(
             "/api/auth/me/password",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "current_password": "Admin123!",
                 "new_password": "weak"
@@ -255,30 +255,30 @@ class TestPasswordChange:
 class TestUserManagement:
     """Test user management endpoints"""
     
-    def test_list_users_admin(self, client, admin_user, admin_token):
+    def test_list_users_admin(self, client, admin_headers):
         """Test admin can list users"""
         response = client.get(
             "/api/auth/users",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
         assert len(response.json()) >= 1
     
-    def test_list_users_non_admin(self, client, viewer_user, viewer_token):
+    def test_list_users_non_admin(self, client, viewer_headers):
         """Test non-admin cannot list users"""
         response = client.get(
             "/api/auth/users",
-            headers={"Authorization": f"Bearer {viewer_token}"}
+            headers=viewer_headers
         )
         
         assert response.status_code == 403
     
-    def test_create_user_admin(self, client, admin_user, admin_token):
+    def test_create_user_admin(self, client, admin_headers):
         """Test admin can create user"""
         response = client.post(
             "/api/auth/users",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "username": "newuser",
                 "email": "new@test.com",
@@ -288,14 +288,15 @@ class TestUserManagement:
         )
         
         assert response.status_code == 200
-        assert response.json()["username"] == "newuser"
-        assert response.json()["role"] == "operator"
+        data = response.json()
+        assert data["username"] == "newuser"
+        assert data["role"] == "operator"
     
-    def test_create_user_duplicate(self, client, admin_user, admin_token):
+    def test_create_user_duplicate(self, client, admin_headers):
         """Test cannot create duplicate user"""
         response = client.post(
             "/api/auth/users",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "username": "admin",  # Already exists
                 "email": "new@test.com",
@@ -305,31 +306,31 @@ class TestUserManagement:
         
         assert response.status_code == 400
     
-    def test_update_user(self, client, admin_user, operator_user, admin_token):
+    def test_update_user(self, client, operator_user, admin_headers):
         """Test admin can update user"""
         response = client.put(
             f"/api/auth/users/{operator_user.id}",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={"role": "viewer"}
         )
         
         assert response.status_code == 200
         assert response.json()["role"] == "viewer"
     
-    def test_delete_user(self, client, admin_user, operator_user, admin_token):
+    def test_delete_user(self, client, operator_user, admin_headers):
         """Test admin can delete user"""
         response = client.delete(
             f"/api/auth/users/{operator_user.id}",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
     
-    def test_cannot_delete_self(self, client, admin_user, admin_token):
+    def test_cannot_delete_self(self, client, admin_user, admin_headers):
         """Test admin cannot delete themselves"""
         response = client.delete(
             f"/api/auth/users/{admin_user.id}",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 400
@@ -338,20 +339,20 @@ class TestUserManagement:
 class TestAuditLog:
     """Test audit log endpoint"""
     
-    def test_get_audit_log_admin(self, client, admin_user, admin_token):
+    def test_get_audit_log_admin(self, client, admin_headers):
         """Test admin can access audit log"""
         response = client.get(
             "/api/auth/audit-log",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
     
-    def test_get_audit_log_non_admin(self, client, viewer_user, viewer_token):
+    def test_get_audit_log_non_admin(self, client, viewer_headers):
         """Test non-admin cannot access audit log"""
         response = client.get(
             "/api/auth/audit-log",
-            headers={"Authorization": f"Bearer {viewer_token}"}
+            headers=viewer_headers
         )
         
         assert response.status_code == 403
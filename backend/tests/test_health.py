@@ -3,15 +3,15 @@ Test Health and Basic Endpoints
 """
 
 import pytest
-from fastapi.testclient import TestClient
 
 
 class TestHealthEndpoints:
     """Test basic health and status endpoints"""
     
-    def test_health_check(self, client):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_health_check(self, async_client):
         """Test health check endpoint (no auth required)"""
-        response = client.get("/api/health")
+        response = await async_client.get("/api/health")
         
         assert response.status_code == 200
         data = response.json()
@@ -19,9 +19,10 @@ class TestHealthEndpoints:
         assert "version" in data
         assert data["auth_enabled"] == True
     
-    def test_setup_required(self, client):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_setup_required(self, async_client):
         """Test setup required endpoint (no auth required)"""
-        response = client.get("/api/setup-required")
+        response = await async_client.get("/api/setup-required")
         
         assert response.status_code == 200
         assert "setup_required" in response.json()
@@ -30,9 +31,10 @@ class TestHealthEndpoints:
 class TestCORS:
     """Test CORS configuration"""
     
-    def test_cors_headers(self, client):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_cors_headers(self, async_client):
         """Test CORS headers are present"""
-        response = client.options(
+        response = await async_client.options(
             "/api/health",
             headers={
                 "Origin": "http://localhost:8420",
@@ -47,23 +49,22 @@ class TestCORS:
 class TestErrorHandling:
     """Test error handling"""
     
-    def test_404_endpoint(self, client, admin_token):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_404_endpoint(self, async_client, admin_headers):
         """Test 404 for non-existent endpoint"""
-        response = client.get(
+        response = await async_client.get(
             "/api/nonexistent",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 404
     
-    def test_invalid_json(self, client, admin_token):
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_invalid_json(self, async_client, admin_headers):
         """Test invalid JSON handling"""
-        response = client.post(
+        response = await async_client.post(
             "/api/nodes/",
-            headers={
-                "Authorization": f"Bearer {admin_token}",
-                "Content-Type": "application/json"
-            },
+            headers={**admin_headers, "Content-Type": "application/json"},
             content="invalid json"
         )
         
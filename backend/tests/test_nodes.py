@@ -3,33 +3,32 @@ Test Nodes API
 """
 
 import pytest
-from fastapi.testclient import TestClient
 
 
 class TestNodesAPI:
     """Test nodes endpoints"""
     
-    def test_list_nodes_authenticated(self, client, admin_user, admin_token):
+    def test_list_nodes_authenticated(self, client, admin_headers):
         """Test listing nodes with authentication"""
         response = client.get(
             "/api/nodes/",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
         assert isinstance(response.json(), list)
     
-    def test_list_nodes_unauthenticated(self, client):
-        """Test listing nodes without authentication"""
-        response = client.get("/api/nodes/")
-        
-        assert response.status_code == 401
-    
-    def test_create_node_operator(self, client, operator_user, operator_token):
-        """Test operator can create node"""
+    @pytest.mark.parametrize("headers_fixture, expected", [
+        ("admin_headers", 200),
+        ("operator_headers", 200),
+        ("viewer_headers", 403),
+    ])
+    def test_create_node_by_role(self, client, request, headers_fixture, expected):
+        """Test admin/operator can create node, viewer cannot"""
+        headers = request.getfixturevalue(headers_fixture)
         response = client.post(
             "/api/nodes/",
-            headers={"Authorization": f"Bearer {operator_token}"},
+            headers=headers,
             json={
                 "name": "new-node",
                 "hostname": "192.168.1.200",
@@ -39,29 +38,17 @@ class TestNodesAPI:
             }
         )
         
-        assert response.status_code == 200
-        data = response.json()
-        assert data["name"] == "new-node"
-        assert data["hostname"] == "192.168.1.200"
-    
-    def test_create_node_viewer_forbidden(self, client, viewer_user, viewer_token):
-        """Test viewer cannot create node"""
-        response = client.post(
-            "/api/nodes/",
-            headers={"Authorization": f"Bearer {viewer_token}"},
-            json={
-                "name": "new-node",
-                "hostname": "192.168.1.200",
-            }
-        )
-        
-        assert response.status_code == 403
+        assert response.status_code == expected
+        if expected == 200:
+            data = response.json()
+            assert data["name"] == "new-node"
+            assert data["hostname"] == "192.168.1.200"
     
-    def test_create_node_duplicate_name(self, client, admin_token, sample_node):
+    def test_create_node_duplicate_name(self, client, admin_headers, sample_node):
         """Test cannot create node with duplicate name"""
         response = client.post(
             "/api/nodes/",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={
                 "name": "test-node",  # Already exists
                 "hostname": "192.168.1.200",
@@ -70,82 +57,68 @@ class TestNodesAPI:
         
         assert response.status_code == 400
     
-    def test_get_node(self, client, admin_token, sample_node):
+    def test_get_node(self, client, admin_headers, sample_node):
         """Test getting a specific node"""
         response = client.get(
             f"/api/nodes/{sample_node.id}",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 200
         assert response.json()["name"] == "test-node"
     
-    def test_get_node_not_found(self, client, admin_token):
+    def test_get_node_not_found(self, client, admin_headers):
         """Test getting non-existent node"""
         response = client.get(
             "/api/nodes/9999",
-            headers={"Authorization": f"Bearer {admin_token}"}
+            headers=admin_headers
         )
         
         assert response.status_code == 404
     
-    def test_update_node(self, client, admin_token, sample_node):
+    def test_update_node(self, client, admin_headers, sample_node):
         """Test updating a node"""
         response = client.put(
             f"/api/nodes/{sample_node.id}",
-            headers={"Authorization": f"Bearer {admin_token}"},
+            headers=admin_headers,
             json={"hostname": "192.168.1.150", "notes": "Updated"}
         )
         
         assert response.status_code == 200
-        assert response.json()["hostname"] == "192.168.1.150"
-        assert response.json()["notes"] == "Updated"
+        data = response.json()
+        assert data["hostname"] == "192.168.1.150"
+        assert data["notes"] == "Updated"
     
-    def test_delete_node_admin_only(self, client, operator_token, sample_node):
+    @pytest.mark.parametrize("headers_fixture, expected", [
+        ("operator_headers", 403),
+        ("admin_headers", 200),
+    ])
+    def test_delete_node_by_role(self, client, request, sample_node, headers_fixture, expected):
         """Test only admin can delete node"""
+        headers = request.getfixturevalue(headers_fixture)
         response = client.delete(
             f"/api/nodes/{sample_node.id}",
-            headers={"Authorization": f"Bearer {operator_token}"}
+            headers=headers
         )
         
-        assert response.status_code == 403
-    
-    def test_delete_node_admin(self, client, admin_token, sample_node):
-        """Test admin can delete node"""
-        response = client.delete(
-            f"/api/nodes/{sample_node.id}",
-            headers={"Authorization": f"Bearer {admin_token}"}
-        )
-        
-        assert response.status_code == 200
+        assert response.status_code == expected
 
 
 class TestNodeAccessControl:
     """Test node access control based on allowed_nodes"""
     
-    def test_user_with_restricted_nodes(self, client, db, viewer_user, sample_node):
+    def test_user_with_restricted_nodes(self, client, db, viewer_user, sample_node, extra_nodes, make_token):
         """Test user can only see allowed nodes"""
-        from services.auth_service import auth_service
-        
-        # Create another node
-        from database import Node
-        other_node = Node(
-            name="other-node",
-            hostname="192.168.1.102"
-        )
-        db.add(other_node)
-        db.commit()
-        
-        # Restrict user to only sample_node
+        # Restrict user to only sample_node (extra_nodes are also present)
         viewer_user.allowed_nodes = [sample_node.id]
         db.commit()
         
-        token = auth_service.create_access_token({
-            "sub": str(viewer_user.id),
-            "username": viewer_user.username,
-            "role": viewer_user.role,
-            "auth_method": viewer_user.auth_method
-        })
+        token = make_token(
+            sub=str(viewer_user.id),
+            username=viewer_user.username,
+            role=viewer_user.role,
+            auth_method=viewer_user.auth_method
+        )
         
         # Should only see allowed node
         response = client.get(
@@ -158,28 +131,20 @@ class TestNodeAccessControl:
         assert len(nodes) == 1
         assert nodes[0]["id"] == sample_node.id
     
-    def test_user_cannot_access_restricted_node(self, client, db, viewer_user, sample_node):
+    def test_user_cannot_access_restricted_node(self, client, db, viewer_user, sample_node, extra_nodes, make_token):
         """Test user cannot access non-allowed node"""
-        from services.auth_service import auth_service
-        from database import Node
-        
-        other_node = Node(
-            name="other-node-2",
-            hostname="192.168.1.103"
-        )
-        db.add(other_node)
-        db.commit()
+        other_node = extra_nodes[1]
         
         # Restrict user
         viewer_user.allowed_nodes = [sample_node.id]
         db.commit()
         
-        token = auth_service.create_access_token({
-            "sub": str(viewer_user.id),
-            "username": viewer_user.username,
-            "role": viewer_user.role,
-            "auth_method": viewer_user.auth_method
-        })
+        token = make_token(
+            sub=str(viewer_user.id),
+            username=viewer_user.username,
+            role=viewer_user.role,
+            auth_method=viewer_user.auth_method
+        )
         
         # Try to access other node
         response = client.get(
@@ -0,0 +1,68 @@
+"""
+Test Proxmox Service
+"""
+
+import pytest
+
+from services.proxmox_service import ProxmoxService
+from services.ssh_service import SSHResult, ssh_service
+
+
+VM_CONFIG = "scsi0: new-zfs:vm-100-disk-0,size=32G\nscsi1: nfs-store:100/vm-100-disk-1.qcow2\n"
+
+
+@pytest.fixture
+def fake_ssh(monkeypatch):
+    """Scripted ssh_service.execute: storage list can change between calls"""
+    state = {"storages": "local-zfs zfspool active\nnfs-store nfs active\n", "commands": []}
+    
+    async def execute(hostname, command, **kwargs):
+        state["commands"].append(command)
+        if command.startswith("pvesm status"):
+            return SSHResult(True, state["storages"], "", 0)
+        if command.startswith("pvesm path new-zfs:vm-100-disk-0"):
+            return SSHResult(True, "/dev/zvol/tank/data/vm-100-disk-0\n", "", 0)
+        return SSHResult(False, "", "", 1)
+    
+    monkeypatch.setattr(ssh_service, "execute", execute)
+    return state
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """ProxmoxService with a fixed VM config (ZFS disk on new-zfs, one NFS disk)"""
+    service = ProxmoxService()
+    
+    async def get_vm_config(*args, **kwargs):
+        return True, VM_CONFIG
+    
+    monkeypatch.setattr(service, "get_vm_config", get_vm_config)
+    return service
+
+
+class TestStorageTypes:
+    """Test the per-node storage type cache"""
+    
+    @pytest.mark.asyncio
+    async def test_unknown_storage_refreshes_cache(self, service, fake_ssh):
+        """Test a zfspool storage added after caching is found"""
+        assert "new-zfs" not in await service.get_storage_types("pve1")
+        
+        # Storage created in Proxmox outside the app
+        fake_ssh["storages"] += "new-zfs zfspool active\n"
+        datasets = await service.find_vm_dataset("pve1", 100)
+        
+        assert datasets == ["tank/data/vm-100-disk-0"]
+        assert sum(c.startswith("pvesm status") for c in fake_ssh["commands"]) == 2
+    
+    @pytest.mark.asyncio
+    async def test_cache_expires(self, service, fake_ssh, monkeypatch):
+        """Test the storage map is read again after the TTL"""
+        await service.get_storage_types("pve1")
+        await service.get_storage_types("pve1")
+        assert len(fake_ssh["commands"]) == 1
+        
+        monkeypatch.setattr(ProxmoxService, "STORAGE_TYPES_TTL", 0)
+        await service.get_storage_types("pve1")
+        
+        assert len(fake_ssh["commands"]) == 2
@@ -0,0 +1,225 @@
+"""
+Test Scheduler Service
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from croniter import croniter
+from sqlalchemy import delete, select, update
+
+from database import Base, async_engine, AsyncSessionLocal, Node, SyncJob, SystemConfig
+from services.scheduler import SchedulerService
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def scheduler_db():
+    """Schema on the app async engine (the one the scheduler uses), emptied after each test"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(SyncJob))
+        await db.execute(delete(Node))
+        await db.execute(delete(SystemConfig))
+        await db.commit()
+
+
+async def _add_job(db, name, schedule, next_run=None):
+    job = SyncJob(
+        name=name,
+        source_node_id=1,
+        source_dataset="rpool/data/vm-100-disk-0",
+        dest_node_id=2,
+        dest_dataset="rpool/replica/vm-100-disk-0",
+        schedule=schedule,
+        next_run=next_run
+    )
+    db.add(job)
+    await db.flush()
+    return job.id
+
+
+async def _next_runs():
+    async with AsyncSessionLocal() as db:
+        return dict((await db.execute(select(SyncJob.id, SyncJob.next_run))).all())
+
+
+class TestAdaptVmConfig:
+    """Test dataset rewriting in the VM config registered on the destination"""
+    
+    @pytest.mark.parametrize("config, expected", [
+        # exact name
+        ("scsi0: zfs:rpool/data,size=32G", "scsi0: zfs:tank/data,size=32G"),
+        ("dataset=rpool/data\n", "dataset=tank/data\n"),
+        # child dataset
+        ("scsi0: zfs:rpool/data/vm-100-disk-0,size=32G", "scsi0: zfs:tank/data/vm-100-disk-0,size=32G"),
+        # names sharing a prefix or suffix are left alone
+        ("scsi0: zfs:myrpool/data/vm-100-disk-0,size=32G", "scsi0: zfs:myrpool/data/vm-100-disk-0,size=32G"),
+        ("scsi0: zfs:rpool/data2/vm-100-disk-0,size=32G", "scsi0: zfs:rpool/data2/vm-100-disk-0,size=32G"),
+        ("scsi0: zfs:backup/rpool/data,size=32G", "scsi0: zfs:backup/rpool/data,size=32G"),
+        # no match
+        ("scsi0: local-zfs:vm-100-disk-0,size=32G", "scsi0: local-zfs:vm-100-disk-0,size=32G"),
+    ])
+    def test_adapt_vm_config(self, config, expected):
+        """Test only whole source dataset names (and their children) are rewritten"""
+        result = SchedulerService()._adapt_vm_config(config, "rpool/data", "tank/data")
+        
+        assert result == expected
+    
+    def test_adapt_vm_config_same_dataset(self):
+        """Test config is unchanged when source and destination match"""
+        config = "scsi0: zfs:rpool/data/vm-100-disk-0,size=32G"
+        
+        assert SchedulerService()._adapt_vm_config(config, "rpool/data", "rpool/data") == config
+
+
+class TestDailySummaryConfig:
+    """Test the daily summary hour read from SystemConfig"""
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    @pytest.mark.parametrize("value, expected", [
+        ("7", 7),
+        ("0", 0),
+        ("23", 23),
+        ("24", SchedulerService.DEFAULT_DAILY_SUMMARY_HOUR),
+        ("-1", SchedulerService.DEFAULT_DAILY_SUMMARY_HOUR),
+        ("eight", SchedulerService.DEFAULT_DAILY_SUMMARY_HOUR),
+    ])
+    async def test_hour(self, scheduler_db, value, expected):
+        """Test hours outside 0-23 fall back to the default instead of breaking the loop"""
+        async with AsyncSessionLocal() as db:
+            db.add(SystemConfig(key="daily_summary_hour", value=value))
+            await db.commit()
+        
+        scheduler = SchedulerService()
+        await scheduler._load_daily_summary_config()
+        
+        assert scheduler._daily_summary_hour == expected
+        assert scheduler._next_daily_summary(datetime.utcnow()) is not None
+
+
+class TestDueJobs:
+    """Test which jobs the scheduler runs"""
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_only_scheduled_jobs_run(self, scheduler_db):
+        """Test stale next_run on unscheduled jobs is cleared and never run"""
+        past = datetime.utcnow() - timedelta(hours=1)
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                Node(id=1, name="source", hostname="192.168.1.100"),
+                Node(id=2, name="dest", hostname="192.168.1.101"),
+            ])
+            scheduled = await _add_job(db, "scheduled", "*/5 * * * *")
+            no_schedule = await _add_job(db, "no-schedule", "", next_run=past)
+            bad_cron = await _add_job(db, "bad-cron", "not a cron", next_run=past)
+            await db.commit()
+        
+        scheduler = SchedulerService()
+        await scheduler._load_jobs()
+        
+        assert set(scheduler._jobs) == {scheduled}
+        next_runs = await _next_runs()
+        assert next_runs[no_schedule] is None
+        assert next_runs[bad_cron] is None
+        
+        # Scheduled job due now; unscheduled one gets a stale past next_run again
+        now = time.time()
+        scheduler._schedule(scheduled, croniter("*/5 * * * *", now), now - 60)
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(SyncJob).where(SyncJob.id == no_schedule).values(next_run=past))
+            await db.commit()
+        
+        ran = []
+        
+        async def record(job_ids):
+            ran.extend(job_ids)
+        
+        scheduler._run_due_jobs = record
+        await scheduler._check_and_run_jobs()
+        for task in list(scheduler._running_tasks):
+            await task
+        
+        assert ran == [scheduled]
+        assert (await _next_runs())[scheduled] > datetime.utcnow()
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_remove_unloaded_job_clears_next_run(self, scheduler_db):
+        """Test removing a job the scheduler never loaded still clears its next_run"""
+        scheduler = SchedulerService()
+        scheduler.remove_job(42)
+        
+        assert scheduler._pending_next_run == {42: None}
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_schedule_change_during_save_kept(self, scheduler_db):
+        """Test a schedule change made while next_runs are being saved is saved next time"""
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                Node(id=1, name="source", hostname="192.168.1.100"),
+                Node(id=2, name="dest", hostname="192.168.1.101"),
+            ])
+            scheduled = await _add_job(db, "scheduled", "*/5 * * * *")
+            other = await _add_job(db, "other", "0 3 * * *")
+            await db.commit()
+        
+        scheduler = SchedulerService()
+        await scheduler._load_jobs()
+        now = time.time()
+        scheduler._schedule(scheduled, croniter("*/5 * * * *", now), now - 60)
+        
+        save = scheduler._save_next_runs
+        calls = []
+        
+        async def save_and_remove(db, next_runs):
+            await save(db, next_runs)
+            calls.append(dict(next_runs))
+            if len(calls) == 2:
+                # Router request served while the scheduler awaits the DB
+                scheduler.remove_job(other)
+        
+        async def record(job_ids):
+            pass
+        
+        scheduler._save_next_runs = save_and_remove
+        scheduler._run_due_jobs = record
+        await scheduler._check_and_run_jobs()
+        
+        assert scheduled in calls[1]
+        assert scheduler._pending_next_run == {other: None}
+    
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_missed_runs_not_replayed(self, scheduler_db):
+        """Test a job far behind runs once and is re-seeded from now, without stepping every missed run"""
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                Node(id=1, name="source", hostname="192.168.1.100"),
+                Node(id=2, name="dest", hostname="192.168.1.101"),
+            ])
+            job_id = await _add_job(db, "every-minute", "* * * * *")
+            await db.commit()
+        
+        now = time.time()
+        cron = croniter("* * * * *", now - 30 * 86400)
+        scheduler = SchedulerService()
+        scheduler._schedule(job_id, cron, cron.get_next(float))
+        
+        steps = []
+        get_next = cron.get_next
+        cron.get_next = lambda *args: steps.append(args) or get_next(*args)
+        ran = []
+        
+        async def record(job_ids):
+            ran.extend(job_ids)
+        
+        scheduler._run_due_jobs = record
+        await scheduler._check_and_run_jobs()
+        for task in list(scheduler._running_tasks):
+            await task
+        
+        assert ran == [job_id]
+        assert len(steps) == 1
+        assert now < scheduler._jobs[job_id][1] <= now + 60
@@ -0,0 +1,244 @@
+"""
+Test SSH Key Service
+"""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from services.ssh_key_service import SSHKeyService, _remove_key_command
+
+
+KEY_A = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIAaaaa root@node-a"
+KEY_B = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIBbbbb root@node-b"
+KEY_RSA = "ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQCc root@node-c"
+
+
+@pytest.fixture
+def remote_home(tmp_path):
+    """Fake remote home with an authorized_keys file"""
+    ssh_dir = tmp_path / ".ssh"
+    ssh_dir.mkdir()
+    (ssh_dir / "authorized_keys").write_text(f"{KEY_A}\n{KEY_B}  \n{KEY_RSA}\n")
+    return tmp_path
+
+
+@pytest.fixture
+def pve_home(tmp_path):
+    """Fake Proxmox node: ~/.ssh/authorized_keys is a symlink to the cluster-wide file"""
+    cluster_keys = tmp_path / "etc" / "pve" / "priv" / "authorized_keys"
+    cluster_keys.parent.mkdir(parents=True)
+    cluster_keys.write_text(f"{KEY_A}\n")
+    home = tmp_path / "root"
+    (home / ".ssh").mkdir(parents=True)
+    (home / ".ssh" / "authorized_keys").symlink_to(cluster_keys)
+    return home
+
+
+class LocalSFTP:
+    """SFTP client working on a local home directory (paths relative to it, like a real session)"""
+    
+    def __init__(self, home):
+        self.home = home
+    
+    def mkdir(self, path, mode=0o777):
+        os.mkdir(self.home / path, mode)
+    
+    def open(self, path, mode="r"):
+        return open(self.home / path, mode + "b")
+    
+    def chmod(self, path, mode):
+        os.chmod(self.home / path, mode)
+    
+    def close(self):
+        pass
+
+
+class LocalClient:
+    def __init__(self, home):
+        self.home = home
+    
+    def open_sftp(self):
+        return LocalSFTP(self.home)
+
+
+def _run_remove(home, key):
+    return subprocess.run(
+        ["sh", "-c", _remove_key_command(key)],
+        env={**os.environ, "HOME": str(home)},
+        cwd=home,
+        capture_output=True
+    )
+
+
+class TestRemoveKeyCommand:
+    """Test the shell command that removes a key from authorized_keys"""
+    
+    @pytest.mark.parametrize("key, remaining", [
+        (KEY_A, [KEY_B + "  ", KEY_RSA]),
+        (KEY_B, [KEY_A, KEY_RSA]),            # trailing whitespace on the line
+        (f"  {KEY_RSA}\n", [KEY_A, KEY_B + "  "]),
+        # partial keys never match whole lines
+        ("ssh-ed25519", [KEY_A, KEY_B + "  ", KEY_RSA]),
+        ("root@node-a", [KEY_A, KEY_B + "  ", KEY_RSA]),
+        ("AAAAC3NzaC1lZDI1NTE5AAAAIAaaaa", [KEY_A, KEY_B + "  ", KEY_RSA]),
+    ])
+    def test_remove_exact_line(self, remote_home, key, remaining):
+        """Test only lines equal to the key are removed"""
+        result = _run_remove(remote_home, key)
+        
+        authorized_keys = remote_home / ".ssh" / "authorized_keys"
+        assert result.returncode == 0
+        assert authorized_keys.read_text().splitlines() == remaining
+        assert authorized_keys.stat().st_mode & 0o777 == 0o600
+        assert os.listdir(remote_home / ".ssh") == ["authorized_keys"]
+    
+    def test_shell_metacharacters_in_key(self, remote_home):
+        """Test quotes and $ in the key are matched literally, not run"""
+        key = "ssh-ed25519 AAAA'\"$(touch pwned)\" x"
+        authorized_keys = remote_home / ".ssh" / "authorized_keys"
+        authorized_keys.write_text(f"{KEY_A}\n{key}\n")
+        
+        result = _run_remove(remote_home, key)
+        
+        assert result.returncode == 0
+        assert authorized_keys.read_text().splitlines() == [KEY_A]
+        assert not (remote_home / "pwned").exists()
+    
+    def test_symlink_kept(self, pve_home):
+        """Test the Proxmox symlink is kept and the cluster-wide file is filtered in place"""
+        (pve_home / ".ssh" / "authorized_keys").resolve().write_text(f"{KEY_A}\n{KEY_B}\n")
+        
+        result = _run_remove(pve_home, KEY_A)
+        
+        authorized_keys = pve_home / ".ssh" / "authorized_keys"
+        assert result.returncode == 0
+        assert authorized_keys.is_symlink()
+        assert authorized_keys.read_text().splitlines() == [KEY_B]
+        assert os.listdir(authorized_keys.resolve().parent) == ["authorized_keys"]
+    
+    def test_missing_file_fails_cleanly(self, tmp_path):
+        """Test failure leaves no temporary file behind"""
+        (tmp_path / ".ssh").mkdir()
+        
+        result = _run_remove(tmp_path, KEY_A)
+        
+        assert result.returncode != 0
+        assert os.listdir(tmp_path / ".ssh") == []
+
+
+class TestAuthorizeKey:
+    """Test adding the public key to authorized_keys over SFTP"""
+    
+    def test_symlink_kept(self, pve_home):
+        """Test the Proxmox symlink is kept and the key lands in the cluster-wide file"""
+        authorized_keys = pve_home / ".ssh" / "authorized_keys"
+        
+        result = SSHKeyService()._authorize_key(LocalClient(pve_home), "pve1", KEY_B, "key")
+        
+        assert result.success and not result.already_present
+        assert authorized_keys.is_symlink()
+        assert authorized_keys.resolve().read_text().splitlines() == [KEY_A, KEY_B]
+    
+    def test_already_present(self, pve_home):
+        """Test a key already in the file is not added again"""
+        result = SSHKeyService()._authorize_key(LocalClient(pve_home), "pve1", KEY_A, "key")
+        
+        assert result.already_present
+        assert (pve_home / ".ssh" / "authorized_keys").read_text() == f"{KEY_A}\n"
+    
+    def test_missing_newline_and_new_file(self, tmp_path):
+        """Test a last line without newline is not joined, and a new file gets mode 0600"""
+        service = SSHKeyService()
+        service._authorize_key(LocalClient(tmp_path), "pve1", KEY_A, "key")
+        authorized_keys = tmp_path / ".ssh" / "authorized_keys"
+        assert authorized_keys.stat().st_mode & 0o777 == 0o600
+        
+        authorized_keys.write_text(KEY_A)
+        service._authorize_key(LocalClient(tmp_path), "pve1", KEY_B, "key")
+        
+        assert authorized_keys.read_text().splitlines() == [KEY_A, KEY_B]
+
+
+@pytest.mark.skipif(shutil.which("ssh-keygen") is None, reason="ssh-keygen not installed")
+class TestGenerateKey:
+    """Test keypairs written by generate_key, checked with ssh-keygen"""
+    
+    @pytest.mark.parametrize("filename, key_type, expected", [
+        ("id_rsa", None, "ssh-rsa"),
+        ("id_ed25519", None, "ssh-ed25519"),
+        ("id_ecdsa", None, "ecdsa-sha2-nistp256"),
+        ("sanoid_key", None, "ssh-ed25519"),
+        ("sanoid_key", "rsa", "ssh-rsa"),
+        ("id_rsa", "rsa", "ssh-rsa"),
+    ])
+    def test_key_type_and_fingerprint(self, tmp_path, filename, key_type, expected):
+        """Test the written key matches the file name and get_key_info reports its fingerprint"""
+        key_path = str(tmp_path / filename)
+        service = SSHKeyService()
+        
+        success, message = service.generate_key(key_path=key_path, key_type=key_type, bits=2048)
+        assert success, message
+        
+        public_key = (tmp_path / f"{filename}.pub").read_text().split()
+        derived = subprocess.run(["ssh-keygen", "-y", "-f", key_path], capture_output=True, text=True, check=True)
+        listed = subprocess.run(["ssh-keygen", "-lf", f"{key_path}.pub"], capture_output=True, text=True, check=True)
+        info = service.get_key_info(key_path)
+        
+        assert public_key[0] == expected
+        assert derived.stdout.split()[:2] == public_key[:2]
+        assert info.key_type == expected
+        assert info.comment == "sanoid-manager"
+        assert info.fingerprint == listed.stdout.split()[1]
+        assert os.stat(key_path).st_mode & 0o777 == 0o600
+    
+    def test_overwrite_updates_fingerprint(self, tmp_path):
+        """Test the cached key info follows a regenerated key"""
+        key_path = str(tmp_path / "id_ed25519")
+        service = SSHKeyService()
+        service.generate_key(key_path=key_path)
+        first = service.get_key_info(key_path).fingerprint
+        
+        assert service.generate_key(key_path=key_path)[0] is False
+        assert service.generate_key(key_path=key_path, overwrite=True)[0] is True
+        
+        listed = subprocess.run(["ssh-keygen", "-lf", f"{key_path}.pub"], capture_output=True, text=True, check=True)
+        assert service.get_key_info(key_path).fingerprint == listed.stdout.split()[1] != first
+    
+    @pytest.mark.parametrize("filename, key_type", [
+        ("id_rsa", "ed25519"),
+        ("id_ed25519", "rsa"),
+        ("id_rsa", "dsa"),
+    ])
+    def test_type_not_matching_file_name(self, tmp_path, filename, key_type):
+        """Test a key type other than the one in a standard file name writes nothing"""
+        success, _ = SSHKeyService().generate_key(key_path=str(tmp_path / filename), key_type=key_type)
+        
+        assert success is False
+        assert os.listdir(tmp_path) == []
+
+
+class TestLocalKeyFiles:
+    """Test checks on the local keypair files"""
+    
+    def test_private_key_without_public_is_kept(self, tmp_path):
+        """Test a lone private key is reported missing but never overwritten implicitly"""
+        key_path = tmp_path / "id_ed25519"
+        key_path.write_text("private")
+        service = SSHKeyService()
+        
+        assert service.get_key_info(str(key_path)).exists is False
+        assert service.generate_key(key_path=str(key_path))[0] is False
+        assert key_path.read_text() == "private"
+    
+    @pytest.mark.asyncio
+    async def test_key_auth_without_private_key(self, tmp_path):
+        """Test key auth fails early when the private key is missing"""
+        (tmp_path / "id_ed25519.pub").write_text(KEY_A + "\n")
+        
+        success, message = await SSHKeyService().test_key_auth("192.0.2.1", key_path=str(tmp_path / "id_ed25519"))
+        
+        assert success is False
+        assert message == "Chiave privata non trovata"
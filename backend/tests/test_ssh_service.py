@@ -0,0 +1,206 @@
+"""
+Test SSH Service
+"""
+
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+
+import paramiko
+import pytest
+
+from services.ssh_service import SSHResult, _recv_both, ssh_pool, ssh_service
+
+
+class FakeChannel:
+    """Channel fed by the test: recv blocks until data, EOF or close()"""
+    
+    def __init__(self, exit_code=0):
+        self.chunks = queue.Queue()
+        self.timeout = "unset"
+        self.exit_code = exit_code
+        self.closed = threading.Event()
+    
+    def settimeout(self, timeout):
+        self.timeout = timeout
+    
+    def set_combine_stderr(self, combine):
+        pass
+    
+    def exec_command(self, command):
+        pass
+    
+    def recv(self, size):
+        if self.closed.is_set():
+            return b""
+        chunk = self.chunks.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+    
+    def recv_exit_status(self):
+        return self.exit_code
+    
+    def close(self):
+        self.closed.set()
+        self.chunks.put(b"")
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    """Fake pooled connection whose session is a FakeChannel"""
+    chan = FakeChannel()
+    
+    class Transport:
+        def open_session(self, timeout=None):
+            return chan
+    
+    class Client:
+        def get_transport(self):
+            return Transport()
+    
+    @contextmanager
+    def acquire(*args, **kwargs):
+        yield Client()
+    
+    monkeypatch.setattr(ssh_pool, "acquire", acquire)
+    return chan
+
+
+async def _collect(**kwargs):
+    return [line async for line in ssh_service.execute_stream("pve1", "syncoid a b", **kwargs)]
+
+
+class TestExecuteStream:
+    """Test streamed command execution"""
+    
+    @pytest.mark.asyncio
+    async def test_lines_and_exit_code(self, channel):
+        """Test output split into lines (also across chunks) without a read timeout"""
+        channel.exit_code = 2
+        for chunk in [b"first li", b"ne\nsecond\nlast", b""]:
+            channel.chunks.put(chunk)
+        result = SSHResult(success=True, stdout="", stderr="", exit_code=-1)
+        
+        lines = await _collect(result=result)
+        
+        assert lines == ["first line", "second", "last"]
+        assert (result.success, result.exit_code) == (False, 2)
+        assert channel.timeout is None
+        assert channel.closed.is_set()
+    
+    @pytest.mark.asyncio
+    async def test_max_duration_closes_channel(self, channel):
+        """Test a silent command is stopped at max_duration, not by an idle timeout"""
+        channel.chunks.put(b"sending\n")
+        
+        with pytest.raises(TimeoutError):
+            await _collect(max_duration=0.2)
+        
+        assert channel.closed.wait(1)
+    
+    @pytest.mark.asyncio
+    async def test_error_closes_channel(self, channel):
+        """Test a read error is raised and the channel still closed"""
+        channel.chunks.put(OSError("connection lost"))
+        
+        with pytest.raises(OSError):
+            await _collect()
+        
+        assert channel.closed.wait(1)
+    
+    @pytest.mark.asyncio
+    async def test_consumer_stop_closes_channel(self, channel):
+        """Test leaving the loop early closes the channel of a still running command"""
+        channel.chunks.put(b"one\ntwo\n")
+        
+        stream = ssh_service.execute_stream("pve1", "syncoid a b")
+        assert await stream.__anext__() == "one"
+        await stream.aclose()
+        
+        assert channel.closed.wait(1)
+
+
+class _ExecServer(paramiko.ServerInterface):
+    """In-process SSH server: every exec request runs handler(channel) in a thread"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+    
+    def get_allowed_auths(self, username):
+        return "none"
+    
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+    
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+    
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.handler, args=(channel,), daemon=True).start()
+        return True
+
+
+@pytest.fixture
+def exec_channel():
+    """Open an exec channel on a paramiko server over a socketpair, running the given handler"""
+    transports = []
+    
+    def open_channel(handler):
+        server_sock, client_sock = socket.socketpair()
+        server = paramiko.Transport(server_sock)
+        server.add_server_key(paramiko.ECDSAKey.generate())
+        started = threading.Thread(target=server.start_server, kwargs={"server": _ExecServer(handler)})
+        started.start()
+        client = paramiko.Transport(client_sock)
+        client.start_client()
+        client.auth_none("root")
+        started.join()
+        transports.extend([client, server])
+        
+        chan = client.open_session()
+        chan.exec_command("zfs send")
+        return chan
+    
+    yield open_channel
+    for transport in transports:
+        transport.close()
+
+
+class TestRecvBoth:
+    """Test reading stdout and stderr of a real paramiko channel"""
+    
+    def test_large_stderr_before_stdout(self, exec_channel):
+        """Test stderr larger than the channel window does not stall the stdout read"""
+        size = 3 * paramiko.common.DEFAULT_WINDOW_SIZE
+        
+        def handler(chan):
+            chan.sendall_stderr(b"e" * size)
+            chan.sendall(b"o" * size)
+            chan.send_exit_status(3)
+            chan.close()
+        
+        chan = exec_channel(handler)
+        stdout, stderr = _recv_both(chan, 10)
+        
+        assert (len(stdout), len(stderr)) == (size, size)
+        assert chan.recv_exit_status() == 3
+    
+    def test_idle_timeout(self, exec_channel):
+        """Test timeout is the time without output, not the total duration"""
+        release = threading.Event()
+        
+        def handler(chan):
+            for _ in range(4):
+                chan.sendall(b"tick\n")
+                release.wait(0.1)
+            release.wait(5)
+            chan.close()
+        
+        chan = exec_channel(handler)
+        try:
+            with pytest.raises(socket.timeout):
+                _recv_both(chan, 0.3)
+        finally:
+            release.set()
@@ -0,0 +1,177 @@
+"""
+Test Syncoid Service
+"""
+
+import shlex
+import subprocess
+
+import pytest
+
+from services.syncoid_service import syncoid_service, TRANSFER_SUMMARY_TAIL
+
+
+SENDING = (
+    "INFO: Sending incremental rpool/data/vm-100-disk-0@syncoid_pve1_2024-01-01:00:00:00 ... "
+    "syncoid_pve1_2024-01-02:00:00:00 (~ 4.2 GB):\n"
+)
+PROGRESS = "1.02GiB 0:00:10 [ 104MiB/s] [=======>                ] 25% ETA 0:00:30\n"
+
+
+class TestParseTransferred:
+    """Test extraction of the transferred size from syncoid output"""
+    
+    @pytest.mark.parametrize("summary, expected", [
+        ("512K transferred", "512K"),
+        ("512KiB transferred", "512KiB"),
+        ("45.2M transferred", "45.2M"),
+        ("45.2MB transferred", "45.2MB"),
+        ("4.20GiB transferred", "4.20GiB"),
+        ("1.5T transferred", "1.5T"),
+        ("sent 812KB", "812KB"),
+        ("sent 3.1G", "3.1G"),
+        ("2TiB total", "2TiB"),
+        ("10.5MiB Total", "10.5MiB"),
+    ])
+    def test_units(self, summary, expected):
+        """Test every size unit and suffix variant"""
+        output = SENDING + PROGRESS + summary + "\n"
+        
+        assert syncoid_service._parse_transferred(output) == expected
+    
+    @pytest.mark.parametrize("output, expected", [
+        # "transferred" wins over "sent"/"total" wherever it appears
+        ("sent 10M\n4.2G transferred\n", "4.2G"),
+        ("9G total\nsent 10M\n", "10M"),
+        ("9G total\n", "9G"),
+        # first occurrence within the same kind
+        ("1G transferred\n2G transferred\n", "1G"),
+    ])
+    def test_priority(self, output, expected):
+        """Test the historical transferred > sent > total priority"""
+        assert syncoid_service._parse_transferred(output) == expected
+    
+    def test_long_output(self):
+        """Test the summary is found at the end of output longer than the scanned tail"""
+        output = SENDING + PROGRESS * (2 * TRANSFER_SUMMARY_TAIL // len(PROGRESS)) + "4.20GiB transferred\n"
+        
+        assert len(output) > TRANSFER_SUMMARY_TAIL
+        assert syncoid_service._parse_transferred(output) == "4.20GiB"
+    
+    def test_summary_before_tail_ignored(self):
+        """Test only the tail is scanned: an early summary followed by long output is not found"""
+        output = "4.20GiB transferred\n" + PROGRESS * (2 * TRANSFER_SUMMARY_TAIL // len(PROGRESS))
+        
+        assert syncoid_service._parse_transferred(output) is None
+    
+    @pytest.mark.parametrize("output", [
+        "",
+        SENDING + PROGRESS,
+        "NEWEST SNAPSHOT: syncoid_pve1_2024-01-02\nINFO: no snapshots to send\n",
+        "CRITICAL ERROR: Target exists but has no snapshots matching with source! sent nothing\n",
+    ])
+    def test_no_match(self, output):
+        """Test output without a transfer summary"""
+        assert syncoid_service._parse_transferred(output) is None
+
+
+def _shell_argv(command, cwd):
+    """Arguments the remote shell would pass to syncoid for the given command line"""
+    result = subprocess.run(
+        ["sh", "-c", "syncoid() { printf '%s\\0' \"$@\"; }; " + command],
+        cwd=cwd,
+        capture_output=True,
+        check=True
+    )
+    return ["syncoid"] + result.stdout.decode().split("\0")[:-1]
+
+
+class TestBuildSyncoidCommand:
+    """Test the syncoid command line sent to the remote shell"""
+    
+    @pytest.mark.parametrize("dataset", [
+        "rpool/data/vm-100-disk-0",
+        "rpool/data/my vm disk",
+        "rpool/data/it's",
+        'rpool/data/"quoted"',
+        "rpool/data/$(touch pwned)",
+        "rpool/data/`touch pwned`",
+        "rpool/data;touch pwned",
+        "rpool/data && touch pwned",
+        "rpool/data|touch pwned",
+        "rpool/data/*",
+        "rpool/data/$HOME",
+    ])
+    def test_dataset_reaches_syncoid_verbatim(self, dataset, tmp_path):
+        """Test datasets with spaces and shell metacharacters stay single arguments"""
+        argv = syncoid_service.build_syncoid_argv(
+            source_host=None, source_dataset=dataset,
+            dest_host="10.0.0.2", dest_dataset=dataset
+        )
+        command = syncoid_service.build_syncoid_command(
+            source_host=None, source_dataset=dataset,
+            dest_host="10.0.0.2", dest_dataset=dataset
+        )
+        
+        assert argv[-2:] == [dataset, f"root@10.0.0.2:{dataset}"]
+        assert _shell_argv(command, tmp_path) == argv
+        assert not (tmp_path / "pwned").exists()
+    
+    @pytest.mark.parametrize("extra_args, expected", [
+        ("--no-privilege-elevation", ["--no-privilege-elevation"]),
+        ("--exclude='vm-1 disk' --identifier=\"a b\"", ["--exclude=vm-1 disk", "--identifier=a b"]),
+        ("--sendoptions='w c'  --debug", ["--sendoptions=w c", "--debug"]),
+        # unbalanced quotes: plain whitespace split, still quoted one by one
+        ("--exclude='oops --debug", ["--exclude='oops", "--debug"]),
+        ("--x=$(touch${IFS}pwned)", ["--x=$(touch${IFS}pwned)"]),
+    ])
+    def test_extra_args(self, extra_args, expected, tmp_path):
+        """Test extra_args are split like a shell would and then passed verbatim"""
+        argv = syncoid_service.build_syncoid_argv(
+            source_host=None, source_dataset="rpool/a",
+            dest_host=None, dest_dataset="rpool/b",
+            extra_args=extra_args
+        )
+        command = syncoid_service.build_syncoid_command(
+            source_host=None, source_dataset="rpool/a",
+            dest_host=None, dest_dataset="rpool/b",
+            extra_args=extra_args
+        )
+        
+        assert argv[-2 - len(expected):-2] == expected
+        assert _shell_argv(command, tmp_path) == argv
+        assert shlex.split(command) == argv
+        assert not (tmp_path / "pwned").exists()
+    
+    @pytest.mark.parametrize("options", [
+        {"recursive": True},
+        {"compress": "zstd"},
+        {"compress": "none"},
+        {"mbuffer_size": "1G"},
+        {"no_sync_snap": True},
+        {"force_delete": True},
+        {"dest_port": 2222},
+        {"dest_key": "/root/.ssh/other"},
+        {"dest_user": "backup"},
+        {"extra_args": "--debug"},
+        {"source_host": "10.0.0.1", "dest_host": None},
+    ])
+    def test_cached_argv_follows_options(self, options):
+        """Test each option gives its own argv, never a cached one for other options"""
+        base = {
+            "source_host": None, "source_dataset": "rpool/a",
+            "dest_host": "10.0.0.2", "dest_dataset": "rpool/b",
+        }
+        default = syncoid_service.build_syncoid_argv(**base)
+        changed = syncoid_service.build_syncoid_argv(**{**base, **options})
+        
+        assert changed != default
+        assert syncoid_service.build_syncoid_argv(**base) == default
+        assert syncoid_service.build_syncoid_argv(**{**base, **options}) == changed
+    
+    def test_returned_argv_is_a_copy(self):
+        """Test mutating a returned argv does not change later (cached) results"""
+        kwargs = {"source_host": None, "source_dataset": "rpool/a", "dest_host": None, "dest_dataset": "rpool/b"}
+        argv = syncoid_service.build_syncoid_argv(**kwargs)
+        argv.append("--injected")
+        
+        assert "--injected" not in syncoid_service.build_syncoid_argv(**kwargs)
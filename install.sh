@@ -524,6 +524,12 @@ SANOID_MANAGER_PORT=$SERVICE_PORT
 # Token expiration (minutes)
 SANOID_MANAGER_TOKEN_EXPIRE=480
 
+# Scheduled syncs run in parallel
+SANOID_MANAGER_MAX_PARALLEL_SYNCS=4
+
+# Pinned node host keys (empty = accept host keys without checking)
+SANOID_MANAGER_KNOWN_HOSTS=
+
 # CORS origins (comma-separated, empty for same-origin only)
 SANOID_MANAGER_CORS_ORIGINS=
 
@@ -733,6 +739,12 @@ migrate_database() {
         sqlite3 "$DB_FILE" "ALTER TABLE sync_jobs ADD COLUMN dest_storage VARCHAR(100);" 2>/dev/null || true
     fi
     
+    # Migrazione: sync_jobs.next_run
+    if ! sqlite3 "$DB_FILE" "PRAGMA table_info(sync_jobs);" | grep -q "next_run"; then
+        log_info "Aggiunta colonna next_run..."
+        sqlite3 "$DB_FILE" "ALTER TABLE sync_jobs ADD COLUMN next_run DATETIME;" 2>/dev/null || true
+    fi
+    
     log_success "Migrazione database completata"
 }
 
@@ -190,6 +190,8 @@ install_update() {
             sqlite3 "$DB_FILE" "ALTER TABLE sync_jobs ADD COLUMN source_storage VARCHAR(100);" 2>/dev/null
         sqlite3 "$DB_FILE" "PRAGMA table_info(sync_jobs);" | grep -q "dest_storage" || \
             sqlite3 "$DB_FILE" "ALTER TABLE sync_jobs ADD COLUMN dest_storage VARCHAR(100);" 2>/dev/null
+        sqlite3 "$DB_FILE" "PRAGMA table_info(sync_jobs);" | grep -q "next_run" || \
+            sqlite3 "$DB_FILE" "ALTER TABLE sync_jobs ADD COLUMN next_run DATETIME;" 2>/dev/null
         
         log_success "Migrazioni applicate"
     fi